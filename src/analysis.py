@@ -0,0 +1,260 @@
+import json
+from collections import namedtuple
+
+WindowStats = namedtuple('WindowStats', [
+    'significant_changes',        # (series, probe) pairs whose relative change exceeded the threshold
+    'avg_change_time',            # mean probe spacing over those pairs, inf when nothing changed
+    'change_ratio',               # share of comparable (series, probe) pairs that changed significantly
+    'mean_time_between_changes',  # window duration divided by the number of probes with at least one change
+])
+
+
+def series_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class SeriesIndex:
+    # Interns label sets into stable integer series IDs. Lookups are keyed on the labels in the order the
+    # response lists them (Prometheus sorts them already), so the canonical sorted key is only built
+    # the first time a label set is seen.
+    def __init__(self):
+        self.ids = {}
+        self.keys = {}
+        self.canonical = {}
+        self.next_id = 0
+        self.free = []
+
+    def intern(self, labels):
+        raw = tuple(labels.items())
+        series_id = self.ids.get(raw)
+        if series_id is None:
+            key = tuple(sorted(raw))
+            series_id = self.canonical.get(key)
+            if series_id is None:
+                # IDs of forgotten series are reused, so IDs stay dense enough to index state arrays
+                if self.free:
+                    series_id = self.free.pop()
+                else:
+                    series_id = self.next_id
+                    self.next_id += 1
+                self.canonical[key] = series_id
+                self.keys[series_id] = key
+            self.ids[raw] = series_id
+        return series_id
+
+    def intern_raw(self, raw):
+        # `raw` is the label set JSON as found in the response body (see prom_client.vector_samples)
+        series_id = self.ids.get(raw)
+        if series_id is None:
+            series_id = self.ids[raw] = self.intern(json.loads(raw))
+        return series_id
+
+    def key(self, series_id):
+        return self.keys[series_id]
+
+    def forget(self, series_ids):
+        series_ids = set(series_ids)
+        self.ids = {raw: series_id for raw, series_id in self.ids.items() if series_id not in series_ids}
+        self.canonical = {key: series_id for key, series_id in self.canonical.items() if series_id not in series_ids}
+        for series_id in series_ids:
+            if self.keys.pop(series_id, None) is not None:
+                self.free.append(series_id)
+
+
+def build_window_matrix(updates):
+    # updates: [(timestamp, [(labels, value), ...]), ...] -> time x series matrix, NaN where a series is missing
+    import numpy as np
+
+    index = {}
+    for _, samples in updates:
+        for labels, _ in samples:
+            index.setdefault(series_key(labels), len(index))
+
+    times = np.fromiter((timestamp for timestamp, _ in updates), dtype=float, count=len(updates))
+    matrix = np.full((len(updates), len(index)), np.nan)
+    for row, (_, samples) in enumerate(updates):
+        if samples:
+            columns = [index[series_key(labels)] for labels, _ in samples]
+            matrix[row, columns] = [value for _, value in samples]
+    return times, list(index), matrix
+
+
+def range_updates(results):
+    # /api/v1/query_range matrix -> [(timestamp, [(labels, value), ...]), ...] ordered by evaluation time
+    probes = {}
+    for result in results:
+        labels = result['metric']
+        for timestamp, value in result['values']:
+            probes.setdefault(float(timestamp), []).append((labels, float(value)))
+    return sorted(probes.items())
+
+
+UNUSED = -2  # probe number of a series ID that holds no series
+
+
+class OnlineAnalyzer:
+    # Incremental window analysis: O(1) state per series instead of buffering the window.
+    # Per-series change statistics (Welford mean/variance and EWMA of the relative change between
+    # consecutive probes) persist across windows in NumPy arrays indexed by interned series ID, so a probe
+    # of thousands of series is folded in with a few vector operations. Window counters are reset by
+    # start_window().
+    def __init__(self, update_threshold, alpha=0.1, capacity=64):
+        import numpy as np
+
+        self.update_threshold = update_threshold
+        self.alpha = alpha
+        self.index = SeriesIndex()
+        self.value = np.zeros(capacity)
+        self.probe = np.full(capacity, UNUSED, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros(capacity)
+        self.m2 = np.zeros(capacity)
+        self.ewma = np.zeros(capacity)
+        self.changes = np.zeros(capacity, dtype=np.int64)
+        self.probes = 0
+        self.window_first_probe = 0
+        self.start_window()
+
+    def reserve(self, size):
+        import numpy as np
+
+        capacity = len(self.value)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name, fill in (('value', 0.0), ('probe', UNUSED), ('count', 0), ('mean', 0.0), ('m2', 0.0),
+                           ('ewma', 0.0), ('changes', 0)):
+            array = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def reset(self, series_ids):
+        self.probe[series_ids] = UNUSED
+        for array in (self.value, self.count, self.mean, self.m2, self.ewma, self.changes):
+            array[series_ids] = 0
+
+    @property
+    def series_count(self):
+        import numpy as np
+
+        return int(np.count_nonzero(self.probe[:self.index.next_id] != UNUSED))
+
+    def variance(self, series_id):
+        count = self.count[series_id]
+        return float(self.m2[series_id] / (count - 1)) if count > 1 else 0.0
+
+    def start_window(self):
+        # Forget series that were not seen at all during the last window (series churn)
+        import numpy as np
+
+        if self.probes > self.window_first_probe:
+            probes = self.probe[:self.index.next_id]
+            gone = np.flatnonzero((probes != UNUSED) & (probes < self.window_first_probe))
+            if len(gone):
+                self.reset(gone)
+                self.index.forget(gone.tolist())
+        self.window_first_probe = self.probes
+        self.window_start = None
+        self.last_time = None
+        self.significant_changes = 0
+        self.total_time = 0.0
+        self.comparable = 0
+        self.changed_probes = 0
+
+    def observe(self, timestamp, samples):
+        intern = self.index.intern
+        return self.observe_ids(timestamp, [intern(labels) for labels, _ in samples], [value for _, value in samples])
+
+    def observe_raw(self, timestamp, raw_labels, values):
+        intern_raw = self.index.intern_raw
+        return self.observe_ids(timestamp, [intern_raw(raw) for raw in raw_labels], values)
+
+    def observe_ids(self, timestamp, series_ids, values):
+        import numpy as np
+
+        probe = self.probes
+        self.probes += 1
+        if self.window_start is None:
+            self.window_start = timestamp
+        time_difference = timestamp - self.last_time if self.last_time is not None else 0.0
+        self.last_time = timestamp
+
+        self.reserve(self.index.next_id)
+        series_ids = np.asarray(series_ids, dtype=np.intp)
+        values = np.asarray(values, dtype=float)
+        previous, previous_probe = self.value[series_ids], self.probe[series_ids]
+        self.value[series_ids] = values
+        self.probe[series_ids] = probe
+        if time_difference == 0.0:
+            return 0
+
+        # Only compare with the sample from the previous probe of this window
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.abs((values - previous) / previous)
+        comparable = (previous_probe == probe - 1) & (previous != 0.0) & np.isfinite(ratio)
+        series_ids, ratio = series_ids[comparable], ratio[comparable]
+
+        count = self.count[series_ids] + 1
+        mean = self.mean[series_ids]
+        delta = ratio - mean
+        mean = mean + delta / count
+        self.m2[series_ids] += delta * (ratio - mean)
+        self.mean[series_ids] = mean
+        self.count[series_ids] = count
+        self.ewma[series_ids] += self.alpha * (ratio - self.ewma[series_ids])
+        self.comparable += len(series_ids)
+
+        significant = ratio > self.update_threshold
+        changed = int(np.count_nonzero(significant))
+        if changed:
+            self.changes[series_ids[significant]] += 1
+            self.significant_changes += changed
+            self.total_time += changed * time_difference
+            self.changed_probes += 1
+        return changed
+
+    def avg_change_time(self):
+        if self.significant_changes == 0:
+            return float('inf')
+        return self.total_time / self.significant_changes
+
+    def state(self):
+        # Per-series change statistics, for warm restarts (see state.py)
+        import numpy as np
+
+        series_ids = np.flatnonzero(self.probe[:self.index.next_id] != UNUSED)
+        return [[[list(pair) for pair in self.index.key(series_id)], float(self.value[series_id]),
+                 int(self.count[series_id]), float(self.mean[series_id]), float(self.m2[series_id]),
+                 float(self.ewma[series_id]), int(self.changes[series_id])]
+                for series_id in series_ids.tolist()]
+
+    def restore(self, series):
+        # Restored series count as seen in the probe before the first window, so they are pruned after it
+        # if they are gone, and never compared with the first new probe
+        for key, value, count, mean, m2, ewma, changes in series:
+            series_id = self.index.intern(dict(key))
+            self.reserve(self.index.next_id)
+            self.probe[series_id] = self.probes - 1
+            self.value[series_id], self.count[series_id], self.mean[series_id] = value, count, mean
+            self.m2[series_id], self.ewma[series_id], self.changes[series_id] = m2, ewma, changes
+
+    def should_decide_early(self, current_scrape_interval, min_changes):
+        return (min_changes > 0 and self.significant_changes >= min_changes
+                and self.avg_change_time() < current_scrape_interval)
+
+    def window_stats(self):
+        if self.significant_changes == 0:
+            return WindowStats(0, float('inf'), 0.0, float('inf'))
+        return WindowStats(
+            self.significant_changes,
+            self.avg_change_time(),
+            self.significant_changes / self.comparable,
+            (self.last_time - self.window_start) / self.changed_probes,
+        )
+
+
+def next_scrape_interval(avg_change_time, current_scrape_interval, min_scrape_interval, max_scrape_interval):
+    if avg_change_time < current_scrape_interval:
+        return max(current_scrape_interval // 2, min_scrape_interval)
+    return min(current_scrape_interval * 2, max_scrape_interval)
@@ -1,80 +1,129 @@
 #!/usr/bin/env python3
 
-import time
-import requests
-import csv
-import yaml
-import os
 import argparse
+import time
 
-# Argument parser
-parser = argparse.ArgumentParser(description="Baseline Prometheus Scrape Monitor")
-parser.add_argument('--duration', type=int, default=3600, help='Monitoring duration in seconds (default: 3600). Use 0 for infinite duration.')
-args = parser.parse_args()
-
-with open('baseline_group.yml', 'r') as config_file:
-    config = yaml.safe_load(config_file)
+from prom_client import response_size
+from query_cache import open_client
+from sinks import open_sink
 
-PROMETHEUS_URL = config['prometheus']['url']
-METRICS_TO_MONITOR = config['metrics']['to_monitor']
-CSV_FILE = config['csv']['file']
+RESULT_SCHEMA = [('Timestamp', 'U', None), ('Metric', 'U', None), ('Metric Value', 'f8', '.6f'),
+                 ('Bandwidth (Mbps)', 'f8', '.2f'), ('Data Size (KB)', 'f8', '.2f')]
 DEFAULT_SCRAPE_INTERVAL = 15
 
 
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Timestamp', 'Metric', 'Metric Value', 'Bandwidth (Mbps)', 'Data Size (KB)'])
+class Baseline:
+    def __init__(self, config):
+        self.config = config
+        self.prometheus_url = config['prometheus']['url']
+        self.metrics_to_monitor = config['metrics']['to_monitor']
+        self.csv_file = config['csv']['file']
+        self.csv_format = config['csv'].get('format', 'csv')
+        self.sink_options = {key: config['csv'][key] for key in ('flush_rows', 'flush_interval', 'max_rows')
+                             if key in config['csv']}
+        self.batch_queries = config['prometheus'].get('batch_queries', False)
+        self.http_options = config.get('http', {})
+        self.cache_options = config.get('cache') or {}
 
-def log_to_csv(timestamp, metric_name, metric_value, bandwidth_mbps, data_size_kb):
-    with open(CSV_FILE, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([timestamp, metric_name, f"{metric_value:.6f}", f"{bandwidth_mbps:.2f}", f"{data_size_kb:.2f}"])
+        # Created by setup(), when monitoring actually starts
+        self.client = self.results_sink = None
 
-def fetch_metric_values(metric_name):
-    start_time = time.time()
-    response = requests.get(f'{PROMETHEUS_URL}/api/v1/query?query={metric_name}')
-    response_time = time.time() - start_time
+    def setup(self):
+        self.client = open_client(self.prometheus_url, self.cache_options, **self.http_options)
+        self.results_sink = open_sink(self.csv_file, RESULT_SCHEMA, self.csv_format, **self.sink_options)
 
-    bandwidth_used = len(response.content)
-    bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time
-    data_size_kb = bandwidth_used / 1024
+    def shutdown(self):
+        self.results_sink.close()
+        self.client.close()
 
-    current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    results = response.json()['data']['result']
+    def log_to_csv(self, timestamp, metric_name, metric_value, bandwidth_mbps, data_size_kb):
+        self.results_sink.write(timestamp, metric_name, metric_value, bandwidth_mbps, data_size_kb)
 
-    if results:
+    def log_results(self, metric_name, results, bandwidth_mbps, data_size_kb):
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
         for result in results:
             metric_value = float(result['value'][1])
             print(f"[{current_time}] Metric: '{metric_name}', Metric Value: {metric_value:.6f}, Bandwidth: {bandwidth_mbps:.2f} Mbps, Data Size: {data_size_kb:.2f} KB")
-            log_to_csv(current_time, metric_name, metric_value, bandwidth_mbps, data_size_kb)
-
+            self.log_to_csv(current_time, metric_name, metric_value, bandwidth_mbps, data_size_kb)
         return [(result['metric'], float(result['value'][1])) for result in results]
-    return []
-
-def collect_metric_updates(metric_name, interval, duration):
-    updates = []
-    end_time = time.time() + duration
-    while time.time() < end_time:
-        current_metric_values = fetch_metric_values(metric_name)
-        if current_metric_values:
-            updates.append((time.time(), current_metric_values))
-        time.sleep(interval)
-    return updates
-
-def monitor_metrics(duration):
-    start_time = time.time()
-    print(f"\n🟢 Starting baseline monitoring for {duration if duration > 0 else '∞'} seconds...")
-
-    while True:
-        for metric_name in METRICS_TO_MONITOR:
-            print(f"Processing metric: {metric_name} every {DEFAULT_SCRAPE_INTERVAL}s")
-            collect_metric_updates(metric_name, DEFAULT_SCRAPE_INTERVAL, DEFAULT_SCRAPE_INTERVAL)
 
-        if duration > 0 and time.time() - start_time >= duration:
-            break
+    def fetch_metric_values(self, metric_name):
+        start_time = time.time()
+        results, response = self.client.query(metric_name)
+        response_time = time.time() - start_time
+
+        bandwidth_used = response_size(response)
+        bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time
+        data_size_kb = bandwidth_used / 1024
+
+        return self.log_results(metric_name, results, bandwidth_mbps, data_size_kb)
+
+    def fetch_all_metric_values(self, metric_names):
+        # One union query for every monitored expression instead of one request per expression
+        start_time = time.time()
+        grouped, responses = self.client.query_many(metric_names)
+        response_time = time.time() - start_time
+
+        bandwidth_used = sum(response_size(response) for response in responses)
+        bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time
+        data_size_kb = bandwidth_used / 1024
+
+        return {
+            metric_name: self.log_results(metric_name, results, bandwidth_mbps, data_size_kb)
+            for metric_name, results in grouped.items()
+        }
+
+    def collect_metric_updates(self, metric_name, interval, duration):
+        updates = []
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            current_metric_values = self.fetch_metric_values(metric_name)
+            if current_metric_values:
+                updates.append((time.time(), current_metric_values))
+            time.sleep(interval)
+        return updates
+
+    def collect_all_metric_updates(self, metric_names, interval, duration):
+        updates = []
+        end_time = time.time() + duration
+        while time.time() < end_time:
+            updates.append((time.time(), self.fetch_all_metric_values(metric_names)))
+            time.sleep(interval)
+        return updates
+
+    def monitor_metrics(self, duration):
+        start_time = time.time()
+        print(f"\n🟢 Starting baseline monitoring for {duration if duration > 0 else '∞'} seconds...")
+
+        while True:
+            if self.batch_queries:
+                print(f"Processing {len(self.metrics_to_monitor)} metrics in one batched query every {DEFAULT_SCRAPE_INTERVAL}s")
+                self.collect_all_metric_updates(self.metrics_to_monitor, DEFAULT_SCRAPE_INTERVAL, DEFAULT_SCRAPE_INTERVAL)
+            else:
+                for metric_name in self.metrics_to_monitor:
+                    print(f"Processing metric: {metric_name} every {DEFAULT_SCRAPE_INTERVAL}s")
+                    self.collect_metric_updates(metric_name, DEFAULT_SCRAPE_INTERVAL, DEFAULT_SCRAPE_INTERVAL)
+
+            if duration > 0 and time.time() - start_time >= duration:
+                break
+
+        print(f"\n✅ Baseline monitoring finished after {duration if duration > 0 else '∞'} seconds.")
+
+    def run(self, duration):
+        self.setup()
+        self.monitor_metrics(duration)
+        self.shutdown()
+
+
+def main(argv=None):
+    from scheduler import load_config
+
+    parser = argparse.ArgumentParser(description="Baseline Prometheus Scrape Monitor")
+    parser.add_argument('--duration', type=int, default=3600, help='Monitoring duration in seconds (default: 3600). Use 0 for infinite duration.')
+    parser.add_argument('--config', default='baseline_group.yml', help='Configuration file (default: baseline_group.yml)')
+    args = parser.parse_args(argv)
+    Baseline(load_config(args.config)).run(args.duration)
 
-    print(f"\n✅ Baseline monitoring finished after {duration if duration > 0 else '∞'} seconds.")
 
 if __name__ == "__main__":
-    monitor_metrics(args.duration)
+    main()
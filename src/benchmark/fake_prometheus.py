@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# Local stand-in for the Prometheus HTTP API used by the benchmark suite: answers /api/v1/query and
+# /api/v1/query_range with synthetic series families, and counts and logs every request and reload.
+# Values are pure functions of (seed, series, time), so any timestamp can be queried, in any order, and
+# two runs with the same seed see the same data. A query naming families (fake_sine, fake_walk, ...)
+# only gets their series; any other query gets every family.
+
+FAMILY_QUERY = re.compile(r'\bfake_(sine|steps|bursts|walk|churn)\b')
+
+
+def uniform(seed, stream, index, slot):
+    # Deterministic uniform [0, 1) per (seed, stream, series index, time slot), vectorized (splitmix64)
+    with np.errstate(over='ignore'):
+        x = (np.asarray(index).astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+             ^ np.asarray(slot).astype(np.int64).astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+             ^ np.uint64((seed * 1000003 + stream) & 0xFFFFFFFFFFFFFFFF))
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+
+class Family:
+    # `count` series whose values are computed for arrays of timestamps (T, 1) and indices (1, N)
+    kind = None
+    stream = 0
+
+    def __init__(self, count, seed=0, period=60.0):
+        self.count = count
+        self.seed = seed
+        self.period = period
+        self.indices = np.arange(count)
+
+    def u(self, index, slot=0, stream=0):
+        return uniform(self.seed, self.stream * 16 + stream, index, slot)
+
+    def values(self, timestamps, indices):
+        raise NotImplementedError
+
+    def instance(self, index, timestamp):
+        return f'{self.kind}-{index}:9100'
+
+    def generation(self, timestamps, indices):
+        # Series identity changes over time only for churn
+        return None
+
+
+class Sine(Family):
+    kind = 'sine'
+    stream = 1
+
+    def values(self, timestamps, indices):
+        # period defaults to 2*pi*60: 50 + 10 * sin(t / 60 + index), as before families existed
+        return 50 + 10 * np.sin(2 * math.pi * timestamps / self.period + indices)
+
+    def instance(self, index, timestamp):
+        return f'node-{index}:9100'
+
+
+class Steps(Family):
+    # Piecewise-constant levels, each series switching on its own period (0.5x to 1.5x) and offset
+    kind = 'steps'
+    stream = 2
+
+    def values(self, timestamps, indices):
+        period = self.period * (0.5 + self.u(indices, stream=1))
+        slot = np.floor((timestamps + self.u(indices, stream=2) * period) / period)
+        return np.round(100 * self.u(indices, slot), 1)
+
+
+class Bursts(Family):
+    # Flat baseline; in each period, a burst lasting a tenth of it with probability 0.2
+    kind = 'bursts'
+    stream = 3
+    probability = 0.2
+
+    def values(self, timestamps, indices):
+        shifted = timestamps + self.u(indices, stream=1) * self.period
+        slot = np.floor(shifted / self.period)
+        start = self.u(indices, slot, stream=2) * 0.9 * self.period
+        offset = shifted - slot * self.period
+        bursting = (self.u(indices, slot, stream=3) < self.probability) & (offset >= start) & (offset < start + self.period / 10)
+        return np.where(bursting, 90.0, 10.0)
+
+
+class Walk(Family):
+    # Stateless random walk: value noise summed over octaves of 1, 2, 4, ... periods with amplitudes
+    # growing as sqrt(length), which has the spectrum of a Brownian motion without a running sum
+    kind = 'walk'
+    stream = 4
+    octaves = 12
+
+    def values(self, timestamps, indices):
+        total = 50.0
+        for octave in range(self.octaves):
+            length = self.period / 60 * 2 ** octave
+            position = timestamps / length
+            slot = np.floor(position)
+            fraction = position - slot
+            left = self.u(indices, slot, stream=octave) - 0.5
+            right = self.u(indices, slot + 1, stream=octave) - 0.5
+            total = total + math.sqrt(2 ** octave) * (left + (right - left) * fraction)
+        return total
+
+
+class Churn(Sine):
+    # Sine values, but every series is replaced by a new one (new instance label) after a lifetime of
+    # 2 to 10 periods, at its own offset
+    kind = 'churn'
+    stream = 5
+
+    def lifetime(self, indices):
+        return self.period * (2 + 8 * self.u(indices, stream=1))
+
+    def generation(self, timestamps, indices):
+        lifetime = self.lifetime(indices)
+        return np.floor((timestamps + self.u(indices, stream=2) * lifetime) / lifetime).astype(np.int64)
+
+    def instance(self, index, timestamp):
+        generation = int(self.generation(np.asarray([[timestamp]]), np.asarray([[index]]))[0, 0])
+        return f'churn-{index}-{generation}:9100'
+
+
+FAMILIES = {family.kind: family for family in (Sine, Steps, Bursts, Walk, Churn)}
+
+
+def parse_families(spec, seed=0):
+    # 'sine:1000,steps:500:30' -> families, as kind:count[:period in seconds]
+    families = []
+    for entry in spec.split(','):
+        kind, count, *period = entry.split(':')
+        if kind not in FAMILIES:
+            raise ValueError(f"Unknown series family '{kind}', expected one of {', '.join(FAMILIES)}")
+        options = {'period': float(period[0])} if period else {}
+        families.append(FAMILIES[kind](int(count), seed, **options))
+    return families
+
+
+class FakePrometheus:
+    def __init__(self, series=1, port=0, host='127.0.0.1', families=None, seed=0, log_file=None):
+        # Without families, `series` sine series as in the original stand-in
+        self.families = families or [Sine(series, seed, period=2 * math.pi * 60)]
+        self.series = sum(family.count for family in self.families)
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'queries': 0, 'range_queries': 0, 'reloads': 0,
+                      'bytes_received': 0, 'bytes_sent': 0}
+        # Every request: time, method, path, query, status, bytes in/out, series returned, handling time
+        self.requests = []
+        self.reloads = []
+        self.log_file = open(log_file, 'a') if log_file else None
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self.thread = None
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                fake.handle(self, 'GET', url.path, parse_qs(url.query), len(self.requestline))
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                params = parse_qs(url.query)
+                params.update(parse_qs(body.decode()))
+                fake.handle(self, 'POST', url.path, params, len(self.requestline) + len(body))
+
+        return Handler
+
+    def selected(self, query):
+        kinds = set(FAMILY_QUERY.findall(query))
+        return [family for family in self.families if not kinds or family.kind in kinds]
+
+    def instant_result(self, timestamp, families):
+        result = []
+        for family in families:
+            times = np.asarray([[timestamp]])
+            values = family.values(times, family.indices[None, :])[0]
+            generations = family.generation(times, family.indices[None, :])
+            if generations is None:
+                instances = [family.instance(index, timestamp) for index in range(family.count)]
+            else:
+                instances = [f'churn-{index}-{generation}:9100' for index, generation in enumerate(generations[0].tolist())]
+            result += [{'metric': {'instance': instance}, 'value': [timestamp, f'{value:.6f}']}
+                       for instance, value in zip(instances, values.tolist())]
+        return result
+
+    def tagged(self, query, result):
+        # Batched union queries tag each expression with label_replace(..., "pace_query", "<index>", "", "")
+        tags = re.findall(r'"pace_query",\s*"(\d+)"', query)
+        if not tags:
+            return result
+        return [dict(series, metric=dict(series['metric'], pace_query=tag)) for tag in tags for series in result]
+
+    def range_result(self, start, end, step, families):
+        steps = [start + offset * step for offset in range(int((end - start) // step) + 1)]
+        times = np.asarray(steps)[:, None]
+        result = []
+        for family in families:
+            values = family.values(times, family.indices[None, :])
+            generations = family.generation(times, family.indices[None, :])
+            for index in range(family.count):
+                column = [[timestamp, f'{value:.6f}'] for timestamp, value in zip(steps, values[:, index].tolist())]
+                if generations is None:
+                    result.append({'metric': {'instance': family.instance(index, start)}, 'values': column})
+                    continue
+                # A churning series shows up as one series per generation it lived in during the range
+                by_generation = {}
+                for generation, point in zip(generations[:, index].tolist(), column):
+                    by_generation.setdefault(generation, []).append(point)
+                result += [{'metric': {'instance': f'churn-{index}-{generation}:9100'}, 'values': points}
+                           for generation, points in by_generation.items()]
+        return result
+
+    def handle(self, request, method, path, params, request_bytes):
+        started = time.perf_counter()
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += request_bytes
+
+        query = params.get('query', [''])[0]
+        series = 0
+        if path == '/-/reload':
+            with self.lock:
+                self.stats['reloads'] += 1
+                self.reloads.append(time.time())
+            status, body = 200, b''
+        elif path == '/api/v1/query':
+            timestamp = float(params.get('time', [time.time()])[0])
+            result = self.tagged(query, self.instant_result(timestamp, self.selected(query)))
+            status, body, series = 200, self.encode({'resultType': 'vector', 'result': result}), len(result)
+            with self.lock:
+                self.stats['queries'] += 1
+        elif path == '/api/v1/query_range':
+            start, end, step = (float(params[key][0]) for key in ('start', 'end', 'step'))
+            result = self.range_result(start, end, step, self.selected(query))
+            status, body, series = 200, self.encode({'resultType': 'matrix', 'result': result}), len(result)
+            with self.lock:
+                self.stats['range_queries'] += 1
+        else:
+            status, body = 404, b'404 page not found'
+
+        self.reply(request, body, status)
+        self.record({'time': time.time(), 'method': method, 'path': path, 'query': query, 'status': status,
+                     'bytes_in': request_bytes, 'bytes_out': len(body), 'series': series,
+                     'duration_ms': round((time.perf_counter() - started) * 1000, 3)})
+
+    def encode(self, data):
+        # Compact separators, as Prometheus itself
+        return json.dumps({'status': 'success', 'data': data}, separators=(',', ':')).encode()
+
+    def record(self, entry):
+        with self.lock:
+            self.requests.append(entry)
+            if self.log_file is not None:
+                self.log_file.write(json.dumps(entry) + '\n')
+                self.log_file.flush()
+
+    def reply(self, request, body, status=200):
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+        with self.lock:
+            self.stats['bytes_sent'] += len(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-prometheus', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.log_file is not None:
+            self.log_file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in Prometheus HTTP API")
+    parser.add_argument('--port', type=int, default=9091)
+    parser.add_argument('--series', type=int, default=1, help='Sine series returned by every query (default: 1)')
+    parser.add_argument('--families', help=f"Series families as kind:count[:period], e.g. sine:1000,walk:500:30 "
+                                           f"(kinds: {', '.join(FAMILIES)}; overrides --series)")
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random families (default: 0)')
+    parser.add_argument('--log', help='Append every request as a JSON line to this file')
+    args = parser.parse_args()
+
+    families = parse_families(args.families, args.seed) if args.families else None
+    fake = FakePrometheus(args.series, args.port, families=families, seed=args.seed, log_file=args.log).start()
+    print(f"Fake Prometheus serving {fake.series} series on {fake.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(fake.stats)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+from remote_write import encode_write_request, snappy_compress  # noqa: E402
+
+# Local stand-in for a Prometheus server with remote_write configured: every `interval` seconds it pushes
+# one sample of `series` gauges (`metric`) and of as many counters (`metric`_total) to a receiver, as
+# snappy-compressed protobuf, so push mode can be exercised without Prometheus.
+
+
+class FakeRemoteWrite:
+    def __init__(self, url, series=1, interval=1.0, metric='fake_gauge', period=60):
+        self.url = url
+        self.series = series
+        self.interval = interval
+        self.metric = metric
+        self.period = period
+        self.stats = {'requests': 0, 'failures': 0, 'samples': 0, 'bytes_sent': 0}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def batch(self, timestamp):
+        series = []
+        for index in range(self.series):
+            labels = {'job': 'node', 'instance': f'node-{index}:9100'}
+            gauge = 50 + 10 * math.sin(2 * math.pi * timestamp / self.period + index)
+            # Counter whose rate follows the gauge
+            counter = 50 * timestamp - 10 * self.period / (2 * math.pi) * math.cos(2 * math.pi * timestamp / self.period + index)
+            series.append((dict(labels, __name__=self.metric), [(timestamp, gauge)]))
+            series.append((dict(labels, __name__=f'{self.metric}_total'), [(timestamp, counter)]))
+        return series
+
+    def push(self, timestamp):
+        body = snappy_compress(encode_write_request(self.batch(timestamp)))
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Content-Encoding': 'snappy',
+            'Content-Type': 'application/x-protobuf',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=10):
+                pass
+        except (urllib.error.URLError, OSError):
+            self.stats['failures'] += 1
+            return
+        self.stats['requests'] += 1
+        self.stats['samples'] += 2 * self.series
+        self.stats['bytes_sent'] += len(body)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.push(time.time())
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='fake-remote-write', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in remote-write sender")
+    parser.add_argument('--url', default='http://localhost:9201/api/v1/write')
+    parser.add_argument('--series', type=int, default=1, help='Gauges (and counters) pushed (default: 1)')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between pushes (default: 1)')
+    parser.add_argument('--metric', default='fake_gauge', help='Gauge name, counters get a _total suffix')
+    args = parser.parse_args()
+
+    sender = FakeRemoteWrite(args.url, args.series, args.interval, args.metric).start()
+    print(f"Pushing {args.series} series every {args.interval}s to {args.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(sender.stats)
+    except KeyboardInterrupt:
+        sender.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+import yaml
+
+from fake_prometheus import FakePrometheus, parse_families
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SRC_DIR)
+
+EXPRESSION = '(1 - avg(rate(node_cpu_seconds_total{mode="idle"}[1m])) by (instance)) * 100'
+
+# mode -> (script, scheduler probe mode)
+MODES = {
+    'fixed': ('baseline.py', None),
+    'adaptive': ('scheduler.py', 'instant'),
+    'adaptive-range': ('scheduler.py', 'range'),
+}
+
+
+def write_configs(directory, url, probe_mode, telemetry_port=None):
+    shutil.copy(os.path.join(SRC_DIR, 'prometheus.yml'), directory)
+    scheduler_config = {
+        'prometheus': {'url': url, 'config_file': 'prometheus.yml', 'reload_url': f'{url}/-/reload',
+                       'reload_debounce': 1},
+        'thresholds': {'update_threshold': 0.05, 'default_scrape_interval': 15, 'min_scrape_interval': 10,
+                       'max_scrape_interval': 900},
+        'scheduler': {'probe_mode': probe_mode or 'instant'},
+        'metrics': {'to_monitor': [EXPRESSION]},
+        'csv': {'file': 'dynamic-results.csv'},
+        'telemetry': {'port': telemetry_port},
+    }
+    baseline_config = {
+        'prometheus': {'url': url, 'batch_queries': True},
+        'metrics': {'to_monitor': [EXPRESSION]},
+        'csv': {'file': 'baseline-results.csv'},
+    }
+    for name, content in [('config.yml', scheduler_config), ('baseline_group.yml', baseline_config)]:
+        with open(os.path.join(directory, name), 'w') as file:
+            yaml.safe_dump(content, file)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def analysis_totals(telemetry_port):
+    # (seconds, windows) of pace_analysis_duration_seconds on the scheduler's own /metrics, None if unreachable
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{telemetry_port}/metrics', timeout=1) as response:
+            body = response.read().decode()
+    except (urllib.error.URLError, OSError):
+        return None
+    totals = dict(re.findall(r'^pace_analysis_duration_seconds_(sum|count) (\S+)$', body, re.MULTILINE))
+    if 'sum' not in totals:
+        return None
+    return float(totals['sum']), float(totals['count'])
+
+
+def decision_latency(totals):
+    # Mean analysis time per window decided by the scheduler under test, from its telemetry
+    if not totals or not totals[1]:
+        return None
+    return round(totals[0] / totals[1] * 1000, 3)
+
+
+def run_mode(mode, series, duration, families=None, seed=0):
+    script, probe_mode = MODES[mode]
+    fake = FakePrometheus(series, families=parse_families(families, seed) if families else None, seed=seed).start()
+    series = fake.series
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            telemetry_port = free_port() if probe_mode else None
+            write_configs(directory, fake.url, probe_mode, telemetry_port)
+            env = dict(os.environ, PYTHONPATH=SRC_DIR)
+            totals = None
+            with open(os.path.join(directory, 'output.log'), 'w+') as log:
+                start_time = time.perf_counter()
+                process = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, script), '--duration', str(duration)],
+                                           cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+                while True:
+                    pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                    if pid:
+                        break
+                    # Last reading before the scheduler exits; windows decided after it are not counted
+                    if telemetry_port:
+                        totals = analysis_totals(telemetry_port) or totals
+                    time.sleep(0.5)
+                wall_time = time.perf_counter() - start_time
+                process.returncode = os.waitstatus_to_exitcode(status)
+                log.seek(0)
+                output = log.read()
+    finally:
+        fake.stop()
+
+    if process.returncode != 0:
+        print(output[-2000:])
+    return {
+        'mode': mode,
+        'series': series,
+        'families': families,
+        'duration': duration,
+        'exit_code': process.returncode,
+        'wall_seconds': round(wall_time, 3),
+        'requests': fake.stats['queries'] + fake.stats['range_queries'],
+        'reloads': fake.stats['reloads'],
+        'bytes_sent': fake.stats['bytes_sent'],
+        'bytes_received': fake.stats['bytes_received'],
+        'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+        'max_rss_kb': usage.ru_maxrss,
+        'decisions': output.count('Probe cost for'),
+        'decision_latency_ms': decision_latency(totals) if probe_mode else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler overhead and scrape savings benchmark")
+    parser.add_argument('--series', default='1,100,10000', help='Comma-separated series counts (default: 1,100,10000)')
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma-separated modes (default: {','.join(MODES)})")
+    parser.add_argument('--duration', type=int, default=60, help='Seconds per run (default: 60)')
+    parser.add_argument('--families', help='Synthetic series families instead of --series, e.g. steps:50000,walk:50000 '
+                                           '(see fake_prometheus.py)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic families (default: 0)')
+    parser.add_argument('--output', default='benchmark-results.json', help='JSON results file')
+    args = parser.parse_args()
+
+    runs = []
+    for series in [0] if args.families else [int(value) for value in args.series.split(',')]:
+        for mode in args.modes.split(','):
+            print(f"Running {mode} with {args.families or series} series for {args.duration}s...")
+            run = run_mode(mode, series, args.duration, args.families, args.seed)
+            print(f"  requests: {run['requests']}, bytes: {run['bytes_sent']}, cpu: {run['cpu_seconds']}s, "
+                  f"rss: {run['max_rss_kb']} KB, decisions: {run['decisions']}, "
+                  f"decision latency: {run['decision_latency_ms']} ms")
+            runs.append(run)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'runs': runs,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
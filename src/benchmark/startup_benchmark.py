@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of a fresh interpreter: the cost paid by every sharded worker and short-lived replay job.
+# Each sample runs in a new process, so nothing is cached in sys.modules between samples.
+STARTUP = r'''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{construct}
+constructed = time.perf_counter()
+heavy = sorted(name for name in ('requests', 'yaml', 'numpy', 'pandas', 'matplotlib', 'http.server') if name in sys.modules)
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'construct_ms': (constructed - imported) * 1000,
+                  'heavy_modules': heavy}}))
+'''
+
+TARGETS = {
+    'scheduler': ('scheduler', 'scheduler.Scheduler(scheduler.load_config({config!r}))'),
+    'baseline': ('baseline', 'baseline.Baseline(__import__("scheduler").load_config({config!r}))'),
+    'replay': ('replay', 'pass'),
+}
+
+
+def sample(target, config):
+    module, construct = TARGETS[target]
+    code = STARTUP.format(module=module, construct=construct.format(config=config))
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=SRC_DIR, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def bare_interpreter_ms(runs):
+    import time
+
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start time of the scheduler library and entry points")
+    parser.add_argument('--runs', type=int, default=20, help='Fresh processes per target (default: 20)')
+    parser.add_argument('--targets', default=','.join(TARGETS), help=f"Comma-separated targets (default: {','.join(TARGETS)})")
+    parser.add_argument('--config', default='config.yaml', help='Scheduler configuration, relative to src/ (default: config.yaml)')
+    parser.add_argument('--baseline-config', default='baseline_group.yml', help='Baseline configuration (default: baseline_group.yml)')
+    args = parser.parse_args()
+
+    print(f"Bare interpreter start: {bare_interpreter_ms(args.runs):.1f} ms (median of {args.runs})")
+    for target in args.targets.split(','):
+        config = args.baseline_config if target == 'baseline' else args.config
+        samples = [sample(target, config) for _ in range(args.runs)]
+        import_ms = statistics.median(run['import_ms'] for run in samples)
+        construct_ms = statistics.median(run['construct_ms'] for run in samples)
+        print(f"{target}: import {import_ms:.1f} ms, construct {construct_ms:.1f} ms, "
+              f"total {import_ms + construct_ms:.1f} ms (median of {args.runs}); "
+              f"heavy modules loaded: {', '.join(samples[0]['heavy_modules']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+from analysis import next_scrape_interval
+
+# Scrape interval controllers: turn the statistics of one probe window into the next interval.
+# A controller instance is created per metric, as it may carry state from one window to the next.
+
+
+class Controller:
+    # Names of the keyword options the controller accepts (`controller` config section, replay policies)
+    options = ()
+
+    def __init__(self, min_scrape_interval, max_scrape_interval):
+        self.min_scrape_interval = min_scrape_interval
+        self.max_scrape_interval = max_scrape_interval
+
+    def clamp(self, scrape_interval):
+        return int(min(max(scrape_interval, self.min_scrape_interval), self.max_scrape_interval))
+
+    def next_interval(self, stats, current_scrape_interval, window_duration):
+        raise NotImplementedError
+
+    def state(self):
+        return {}
+
+    def restore(self, state):
+        pass
+
+
+class HalvingController(Controller):
+    # Original policy: halve when changes come faster than the current interval, double otherwise
+    def next_interval(self, stats, current_scrape_interval, window_duration):
+        return next_scrape_interval(stats.avg_change_time, current_scrape_interval,
+                                    self.min_scrape_interval, self.max_scrape_interval)
+
+
+class NyquistController(Controller):
+    # Sets the interval directly to `samples_per_change` scrapes per estimated change period, so a new
+    # regime is reached in one or two windows instead of one halving/doubling step per window.
+    # The change period is (probed time) / (changed probes), both decayed by `memory` per window. A window
+    # without changes only shows that the period is longer than the window, so quiet windows grow the
+    # interval instead: `growth` times for the first, and `growth` times more for each consecutive quiet
+    # window (x2, x4, x8 with the default growth of 2). Estimates within `hysteresis` (relative) of the
+    # current interval are ignored, except when the estimate is clamped to the minimum or maximum interval.
+    options = ('samples_per_change', 'hysteresis', 'memory', 'growth')
+
+    def __init__(self, min_scrape_interval, max_scrape_interval, samples_per_change=2, hysteresis=0.25, memory=0.8,
+                 growth=2):
+        super().__init__(min_scrape_interval, max_scrape_interval)
+        self.samples_per_change = samples_per_change
+        self.hysteresis = hysteresis
+        self.memory = memory
+        self.growth = growth
+        self.changes = 0.0
+        self.duration = 0.0
+        self.quiet_windows = 0
+
+    def next_interval(self, stats, current_scrape_interval, window_duration):
+        changes = 0.0
+        if stats.significant_changes:
+            changes = window_duration / stats.mean_time_between_changes
+            self.quiet_windows = 0
+        else:
+            self.quiet_windows += 1
+        self.changes = self.memory * self.changes + changes
+        self.duration = self.memory * self.duration + window_duration
+
+        estimate = self.duration / self.changes / self.samples_per_change if self.changes > 0.0 else float('inf')
+        target = min(estimate, current_scrape_interval * self.growth)
+        if self.quiet_windows == 1:
+            # Nothing seen in this window is no reason to scrape faster
+            target = max(target, current_scrape_interval)
+        elif self.quiet_windows > 1:
+            target = max(current_scrape_interval * self.growth,
+                         min(current_scrape_interval * self.growth ** self.quiet_windows, estimate))
+        clamped = self.clamp(target)
+        if clamped in (self.min_scrape_interval, self.max_scrape_interval):
+            # Otherwise an interval just short of a bound would be kept there by hysteresis
+            return clamped
+        if abs(clamped - current_scrape_interval) <= self.hysteresis * current_scrape_interval:
+            return current_scrape_interval
+        return clamped
+
+    def state(self):
+        return {'changes': self.changes, 'duration': self.duration, 'quiet_windows': self.quiet_windows}
+
+    def restore(self, state):
+        self.changes = state.get('changes', 0.0)
+        self.duration = state.get('duration', 0.0)
+        self.quiet_windows = state.get('quiet_windows', 0)
+
+
+CONTROLLERS = {
+    'halving': HalvingController,
+    'nyquist': NyquistController,
+}
+
+
+def make_controller(name, min_scrape_interval, max_scrape_interval, **options):
+    if name not in CONTROLLERS:
+        raise ValueError(f"Unknown controller '{name}', expected one of {', '.join(CONTROLLERS)}")
+    return CONTROLLERS[name](min_scrape_interval, max_scrape_interval, **options)
@@ -1,35 +1,258 @@
 #!/usr/bin/env python3
 
+import argparse
+import json
+import mmap
 import os
-import sys
+import struct
 
-# Check if the required parameters are passed
-if len(sys.argv) != 3:
-    print("Usage: python script.py <pcap_file> <capture_duration_seconds>")
-    sys.exit(1)
+# Single streaming pass over a pcap/pcapng capture through mmap: per-port, per-direction payload bytes,
+# packet rates and a time-bucketed bandwidth series, in constant memory.
 
-# Path to the pcap file and capture duration
-pcap_file = sys.argv[1]
-capture_duration_seconds = int(sys.argv[2])
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
 
-# Determine the size of the file in bytes
-data_size_bytes = os.path.getsize(pcap_file)
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 14, 101)
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
 
-# Convert the size to kilobytes (KB) and megabytes (MB)
-data_size_kb = data_size_bytes / 1024
-data_size_mb = data_size_kb / 1024
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+TCP = 6
+UDP = 17
 
-print(f"Data Size: {data_size_bytes} Bytes")
-print(f"Data Size: {data_size_kb:.2f} KB")
-print(f"Data Size: {data_size_mb:.2f} MB")
 
-# Calculate bandwidth in bits per second (bps)
-bandwidth_bps = (data_size_bytes * 8) / capture_duration_seconds
+def pcap_packets(data):
+    endian, resolution = PCAP_MAGIC[bytes(data[:4])]
+    linktype = struct.unpack_from(f'{endian}I', data, 20)[0]
+    record = struct.Struct(f'{endian}IIII')
+    offset = 24
+    while offset + 16 <= len(data):
+        seconds, fraction, captured, original = record.unpack_from(data, offset)
+        offset += 16
+        if offset + captured > len(data):
+            break
+        yield seconds + fraction * resolution, linktype, offset, captured, original
+        offset += captured
 
-# Convert to kilobits per second (kbps) and megabits per second (Mbps)
-bandwidth_kbps = bandwidth_bps / 1000
-bandwidth_mbps = bandwidth_kbps / 1000
 
-print(f"Bandwidth: {bandwidth_bps:.2f} bps")
-print(f"Bandwidth: {bandwidth_kbps:.2f} kbps")
-print(f"Bandwidth: {bandwidth_mbps:.2f} Mbps")
+def pcapng_packets(data):
+    endian = '<'
+    interfaces = []
+    offset = 0
+    while offset + 12 <= len(data):
+        block_type = struct.unpack_from(f'{endian}I', data, offset)[0]
+        if block_type == PCAPNG_SECTION_HEADER:
+            endian = '<' if struct.unpack_from('<I', data, offset + 8)[0] == 0x1A2B3C4D else '>'
+            interfaces = []
+        block_length = struct.unpack_from(f'{endian}I', data, offset + 4)[0]
+        if block_length < 12:
+            break
+        body = offset + 8
+
+        if block_type == 1:
+            linktype = struct.unpack_from(f'{endian}H', data, body)[0]
+            interfaces.append((linktype, interface_resolution(data, endian, body + 8, offset + block_length - 4)))
+        elif block_type == 6:
+            interface, high, low, captured, original = struct.unpack_from(f'{endian}IIIII', data, body)
+            if body + 20 + captured > len(data):
+                break
+            linktype, resolution = interfaces[interface]
+            yield ((high << 32) | low) * resolution, linktype, body + 20, captured, original
+        elif block_type == 3 and interfaces:
+            original = struct.unpack_from(f'{endian}I', data, body)[0]
+            captured = min(original, block_length - 16)
+            yield None, interfaces[0][0], body + 4, captured, original
+
+        offset += block_length
+
+
+def interface_resolution(data, endian, offset, end):
+    # if_tsresol option (code 9): 10^-n, or 2^-n when the high bit is set; default is microseconds
+    while offset + 4 <= end:
+        code, length = struct.unpack_from(f'{endian}HH', data, offset)
+        if code == 0:
+            break
+        if code == 9:
+            value = data[offset + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        offset += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def network_layer(data, linktype, offset, captured):
+    # Returns (IP version, offset of the IP header) or None for non-IP frames
+    end = offset + captured
+    header_length = {LINKTYPE_ETHERNET: 14, LINKTYPE_LINUX_SLL: 16, LINKTYPE_LINUX_SLL2: 20,
+                     LINKTYPE_NULL: 4, LINKTYPE_LOOP: 4}.get(linktype, 0)
+    if offset + header_length >= end:
+        return None
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = struct.unpack_from('>H', data, offset + 12)[0]
+        offset += 14
+        while ethertype in (0x8100, 0x88A8) and offset + 4 <= end:
+            ethertype = struct.unpack_from('>H', data, offset + 2)[0]
+            offset += 4
+        version = {0x0800: 4, 0x86DD: 6}.get(ethertype)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        version = {0x0800: 4, 0x86DD: 6}.get(struct.unpack_from('>H', data, offset + 14)[0])
+        offset += 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        version = {0x0800: 4, 0x86DD: 6}.get(struct.unpack_from('>H', data, offset)[0])
+        offset += 20
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        offset += 4
+        version = data[offset] >> 4 if offset < end else None
+    elif linktype in LINKTYPE_RAW:
+        version = data[offset] >> 4 if offset < end else None
+    else:
+        return None
+    if version not in (4, 6) or offset >= end:
+        return None
+    return version, offset
+
+
+def transport_layer(data, version, offset, end):
+    # Returns (source port, destination port, payload bytes) for TCP/UDP, or None
+    if version == 4:
+        if offset + 20 > end:
+            return None
+        header_length = (data[offset] & 0x0F) * 4
+        total_length, fragment = struct.unpack_from('>H2xH', data, offset + 2)
+        protocol = data[offset + 9]
+        if fragment & 0x1FFF:
+            return None
+        remaining = total_length - header_length
+        offset += header_length
+    else:
+        if offset + 40 > end:
+            return None
+        remaining = struct.unpack_from('>H', data, offset + 4)[0]
+        protocol = data[offset + 6]
+        offset += 40
+        while protocol in IPV6_EXTENSION_HEADERS or protocol == IPV6_FRAGMENT:
+            if offset + 8 > end:
+                return None
+            length = 8 if protocol == IPV6_FRAGMENT else (data[offset + 1] + 1) * 8
+            protocol = data[offset]
+            remaining -= length
+            offset += length
+
+    if offset + 4 > end or protocol not in (TCP, UDP):
+        return None
+    source, destination = struct.unpack_from('>HH', data, offset)
+    if protocol == TCP:
+        if offset + 13 > end:
+            return None
+        payload = remaining - (data[offset + 12] >> 4) * 4
+    else:
+        payload = remaining - 8
+    return source, destination, max(payload, 0)
+
+
+def analyze_capture(pcap_file, ports, bucket_seconds):
+    totals = {port: {direction: {'packets': 0, 'wire_bytes': 0, 'payload_bytes': 0}
+                     for direction in ('to_port', 'from_port')}
+              for port in ports}
+    buckets = {}
+    summary = {'packets': 0, 'ip_packets': 0, 'wire_bytes': 0, 'first_timestamp': None, 'last_timestamp': None}
+
+    with open(pcap_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if bytes(data[:4]) in PCAP_MAGIC:
+            packets = pcap_packets(data)
+        elif struct.unpack_from('<I', data, 0)[0] == PCAPNG_SECTION_HEADER:
+            packets = pcapng_packets(data)
+        else:
+            raise SystemExit(f"{pcap_file} is not a pcap or pcapng capture")
+
+        timestamp = 0.0
+        for packet_timestamp, linktype, offset, captured, original in packets:
+            if packet_timestamp is not None:
+                timestamp = packet_timestamp
+            if summary['first_timestamp'] is None:
+                summary['first_timestamp'] = timestamp
+            summary['last_timestamp'] = timestamp
+            summary['packets'] += 1
+            summary['wire_bytes'] += original
+
+            network = network_layer(data, linktype, offset, captured)
+            if network is None:
+                continue
+            summary['ip_packets'] += 1
+            transport = transport_layer(data, network[0], network[1], offset + captured)
+            if transport is None:
+                continue
+
+            source, destination, payload = transport
+            bucket = int(timestamp // bucket_seconds) * bucket_seconds
+            for port, direction in ((destination, 'to_port'), (source, 'from_port')):
+                if port in totals:
+                    counters = totals[port][direction]
+                    counters['packets'] += 1
+                    counters['wire_bytes'] += original
+                    counters['payload_bytes'] += payload
+                    key = (bucket, port)
+                    buckets[key] = buckets.get(key, 0) + payload
+
+    return summary, totals, buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-port bandwidth of a pcap/pcapng capture")
+    parser.add_argument('pcap_file')
+    parser.add_argument('capture_duration_seconds', type=float, nargs='?',
+                        help='Capture duration (default: time between the first and last packet)')
+    parser.add_argument('--ports', default='9091,9092',
+                        help='Comma-separated ports to account separately (default: 9091,9092)')
+    parser.add_argument('--bucket', type=int, default=60, help='Bandwidth series bucket size in seconds (default: 60)')
+    parser.add_argument('--json', help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    ports = [int(port) for port in args.ports.split(',') if port]
+    summary, totals, buckets = analyze_capture(args.pcap_file, ports, args.bucket)
+
+    span = (summary['last_timestamp'] - summary['first_timestamp']) if summary['packets'] else 0.0
+    duration = args.capture_duration_seconds or span or 1.0
+
+    # File-level figures, as reported before per-port accounting existed
+    data_size_bytes = os.path.getsize(args.pcap_file)
+    print(f"Data Size: {data_size_bytes} Bytes")
+    print(f"Data Size: {data_size_bytes / 1024:.2f} KB")
+    print(f"Data Size: {data_size_bytes / 1024 / 1024:.2f} MB")
+    print(f"Bandwidth: {data_size_bytes * 8 / duration:.2f} bps")
+    print(f"Bandwidth: {data_size_bytes * 8 / duration / 1000:.2f} kbps")
+    print(f"Bandwidth: {data_size_bytes * 8 / duration / 1000 / 1000:.2f} Mbps")
+
+    print(f"\nPackets: {summary['packets']} ({summary['packets'] / duration:.2f} pps), "
+          f"IP packets: {summary['ip_packets']}, wire bytes: {summary['wire_bytes']}, duration: {duration:.2f}s")
+    for port in ports:
+        for direction, counters in totals[port].items():
+            label = f"to {port}" if direction == 'to_port' else f"from {port}"
+            print(f"Port {label:>10}: {counters['packets']} packets ({counters['packets'] / duration:.2f} pps), "
+                  f"payload: {counters['payload_bytes']} Bytes ({counters['payload_bytes'] * 8 / duration / 1000:.2f} kbps), "
+                  f"wire: {counters['wire_bytes']} Bytes")
+
+    series = {port: [] for port in ports}
+    for (bucket, port), payload in sorted(buckets.items()):
+        series[port].append({'start': bucket, 'payload_bytes': payload, 'kbps': payload * 8 / args.bucket / 1000})
+    print(f"\nPayload bandwidth per {args.bucket}s bucket (kbps):")
+    for port in ports:
+        print(f"  {port}: " + ', '.join(f"{point['kbps']:.2f}" for point in series[port]))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'file_bytes': data_size_bytes, 'duration': duration, 'summary': summary,
+                       'ports': {str(port): totals[port] for port in ports},
+                       'buckets': {str(port): series[port] for port in ports}}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
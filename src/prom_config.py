@@ -0,0 +1,260 @@
+import copy
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+
+import telemetry
+
+# Per-tier copies of an exporter job are named '<job>@<interval>s'
+TIER_JOB = re.compile(r'^(?P<job>.+)@(?P<interval>\d+)s$')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value):
+    # Prometheus durations such as '15s', '1m30s'
+    matches = re.findall(r'(\d+)(ms|s|m|h|d)', str(value))
+    return sum(int(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def relabel_regex(values):
+    # RE2 alternation matching exactly `values`
+    return '|'.join(re.escape(value) for value in sorted(values))
+
+
+class PrometheusConfig:
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    def load(self):
+        import yaml
+
+        with open(self.path, 'rb') as file:
+            self.config = yaml.safe_load(file)
+        self.config.setdefault('scrape_configs', [])
+        self.jobs = {job['job_name']: job for job in self.config['scrape_configs']}
+        # Pristine definitions of the jobs currently split into tiers, without the leading drop rule
+        self.base_jobs = {}
+        for job_name in self.jobs:
+            match = TIER_JOB.match(job_name)
+            base = self.jobs.get(match['job']) if match else None
+            if base is not None and match['job'] not in self.base_jobs and base.get('relabel_configs'):
+                self.base_jobs[match['job']] = self.strip_tier_rules(base, 1)
+        self.rendered = self.render()
+
+    def strip_tier_rules(self, job, count):
+        job = copy.deepcopy(job)
+        job['relabel_configs'] = job['relabel_configs'][count:]
+        if not job['relabel_configs']:
+            del job['relabel_configs']
+        return job
+
+    def get_scrape_interval(self, job_name, default):
+        job = self.jobs.get(job_name)
+        if job is None:
+            return default
+        return parse_duration(job.get('scrape_interval', f'{default}s')) or default
+
+    def set_scrape_interval(self, job_name, scrape_interval, targets):
+        job = self.jobs.get(job_name)
+        if job is None:
+            targets = targets if isinstance(targets, str) else list(targets)
+            job = {'job_name': job_name, 'static_configs': [{'targets': targets}]}
+            self.config['scrape_configs'].append(job)
+            self.jobs[job_name] = job
+        job['scrape_interval'] = f'{scrape_interval}s'
+
+    def set_tiers(self, job_name, assignment):
+        # Moves targets (instance -> tier interval) of an exporter job into '<job>@<tier>s' copies that keep
+        # only them by __address__ and restore the original job label; the job itself drops them.
+        base = self.base_jobs.get(job_name) or copy.deepcopy(self.jobs.get(job_name))
+        if base is None:
+            return False
+        global_config = self.config.get('global') or {}
+        base_interval = parse_duration(base.get('scrape_interval') or global_config.get('scrape_interval', '1m'))
+        base_timeout = parse_duration(base.get('scrape_timeout') or global_config.get('scrape_timeout', '10s'))
+
+        tiers = {}
+        for instance, tier in assignment.items():
+            if tier != base_interval:
+                tiers.setdefault(tier, []).append(instance)
+
+        jobs = [copy.deepcopy(base)]
+        if tiers:
+            moved = [instance for instances in tiers.values() for instance in instances]
+            jobs[0]['relabel_configs'] = [{'source_labels': ['__address__'], 'regex': relabel_regex(moved),
+                                           'action': 'drop'}] + base.get('relabel_configs', [])
+            for tier, instances in sorted(tiers.items()):
+                job = copy.deepcopy(base)
+                job['job_name'] = f'{job_name}@{tier}s'
+                job['scrape_interval'] = f'{tier}s'
+                if tier < base_timeout:
+                    job['scrape_timeout'] = f'{tier}s'
+                job['relabel_configs'] = [
+                    {'source_labels': ['__address__'], 'regex': relabel_regex(instances), 'action': 'keep'},
+                    {'target_label': 'job', 'replacement': job_name},
+                ] + base.get('relabel_configs', [])
+                jobs.append(job)
+            self.base_jobs[job_name] = base
+        else:
+            self.base_jobs.pop(job_name, None)
+
+        scrape_configs = self.config['scrape_configs']
+        position = next(index for index, job in enumerate(scrape_configs) if job['job_name'] == job_name)
+        remaining = [job for job in scrape_configs
+                     if job['job_name'] != job_name and not self.is_tier_of(job['job_name'], job_name)]
+        self.config['scrape_configs'] = remaining[:position] + jobs + remaining[position:]
+        self.jobs = {job['job_name']: job for job in self.config['scrape_configs']}
+        return True
+
+    def is_tier_of(self, name, job_name):
+        match = TIER_JOB.match(name)
+        return bool(match) and match['job'] == job_name
+
+    def render(self):
+        import yaml
+
+        return yaml.safe_dump(self.config).encode()
+
+    def write(self, data):
+        # Write next to the target and rename over it so Prometheus never reads a half-written file.
+        # A symlinked config is replaced at its target, and the file keeps its mode and owner (the
+        # temporary file is created 0600, which a Prometheus running as another user could not read).
+        path = os.path.realpath(self.path)
+        try:
+            original = os.stat(path)
+        except FileNotFoundError:
+            original = None
+        with tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), prefix='.prometheus-', delete=False) as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+            if original is not None:
+                os.chmod(file.fileno(), stat.S_IMODE(original.st_mode))
+                if (original.st_uid, original.st_gid) != (os.getuid(), os.getgid()):
+                    try:
+                        os.chown(file.fileno(), original.st_uid, original.st_gid)
+                    except PermissionError:
+                        print(f"Cannot give {path} back to uid {original.st_uid}, it is now owned by this process.")
+        os.replace(file.name, path)
+        self.rendered = data
+
+
+class ConfigWriter:
+    def __init__(self, prometheus_config, reload_url, targets, session=None, debounce=5, tiers=None):
+        self.prometheus_config = prometheus_config
+        # Several Prometheus servers may read the same config file: each of them is reloaded
+        self.reload_urls = [reload_url] if isinstance(reload_url, str) else list(reload_url)
+        self.targets = targets
+        if session is None:
+            import requests
+
+            session = requests.Session()
+        self.session = session
+        self.debounce = debounce
+        self.tiers = tiers
+
+        self.pending = {}
+        self.pending_jobs = set()
+        self.deadline = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.io_lock = threading.Lock()
+        self.stats = {'changes': 0, 'writes': 0, 'reloads': 0, 'failed_reloads': 0,
+                      'coalesced': 0, 'unchanged': 0}
+
+        self.thread = threading.Thread(target=self.run, name='config-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, job_name, scrape_interval, targets=None, urgent=False):
+        # With interval tiers, `targets` are the (job, instance) pairs the expression depends on.
+        # Urgent changes (alarm triggers) are written without waiting for the debounce window.
+        with self.condition:
+            if self.tiers is not None and targets is not None:
+                self.pending_jobs |= self.tiers.update(job_name, scrape_interval, targets)
+            else:
+                self.pending[job_name] = scrape_interval
+            self.stats['changes'] += 1
+            if urgent:
+                self.deadline = time.time()
+                self.condition.notify()
+            elif self.deadline is None:
+                self.deadline = time.time() + self.debounce
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.deadline is None or time.time() < self.deadline):
+                    self.condition.wait(None if self.deadline is None else self.deadline - time.time())
+                if self.closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        # The condition is only held to take the pending changes, so submit() never waits for a write or
+        # a reload. io_lock is taken first so batches reach the file in the order they were submitted.
+        with self.io_lock:
+            with self.condition:
+                pending, self.pending, self.deadline = self.pending, {}, None
+                pending_jobs, self.pending_jobs = self.pending_jobs, set()
+                assignments = {job_name: self.tiers.assignment(job_name) for job_name in sorted(pending_jobs)}
+            self.apply(pending, assignments)
+
+    def apply(self, pending, assignments):
+        if not pending and not assignments:
+            return
+
+        for job_name, scrape_interval in pending.items():
+            self.prometheus_config.set_scrape_interval(job_name, scrape_interval, self.targets)
+        for job_name, assignment in assignments.items():
+            if not self.prometheus_config.set_tiers(job_name, assignment):
+                print(f"Scrape job {job_name} is not defined in {self.prometheus_config.path}, leaving its targets alone.")
+        self.stats['coalesced'] += max(len(pending) + len(assignments) - 1, 0)
+
+        data = self.prometheus_config.render()
+        if data == self.prometheus_config.rendered:
+            self.stats['unchanged'] += 1
+            print("Prometheus config unchanged, skipping reload.")
+            return
+
+        self.prometheus_config.write(data)
+        self.stats['writes'] += 1
+        telemetry.CONFIG_WRITES.inc()
+        self.reload()
+
+    def reload(self):
+        for reload_url in self.reload_urls:
+            self.reload_one(reload_url)
+
+    def reload_one(self, reload_url):
+        import requests
+
+        try:
+            response = self.session.post(reload_url, timeout=10)
+            reloaded = response.status_code == 200
+        except requests.RequestException:
+            reloaded = False
+
+        if reloaded:
+            self.stats['reloads'] += 1
+            telemetry.RELOADS.inc()
+            print("Prometheus reloaded with updated intervals.")
+        else:
+            self.stats['failed_reloads'] += 1
+            telemetry.RELOAD_FAILURES.inc()
+            print(f"Failed to reload Prometheus at {reload_url}")
+
+    def reloads_avoided(self):
+        # Every write triggers one reload round (of each Prometheus sharing the file)
+        return self.stats['changes'] - self.stats['writes']
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
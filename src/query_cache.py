@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import gzip
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import telemetry
+from prom_client import PrometheusClient
+
+# Query result cache shared by concurrent consumers of the same expressions (adaptive scheduler, alarm
+# policy, baseline). Results are keyed by normalized query and evaluation-time bucket, kept for `ttl`
+# seconds in an LRU of `max_entries`, and a query already in flight is awaited instead of sent again.
+# In-process: CachingPrometheusClient (`cache` config section). Across processes: run this file as a
+# proxy in front of Prometheus and point `prometheus.url` at it.
+
+QUOTED = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`')
+PUNCTUATION = re.compile(r'\s*([(){}\[\],=!~<>+\-*/^%])\s*')
+CACHED_PATHS = ('/api/v1/query', '/api/v1/query_range')
+
+shared_caches = {}
+shared_caches_lock = threading.Lock()
+
+
+def normalize_query(expression):
+    # Whitespace-insensitive form of a PromQL expression; quoted strings are kept as they are
+    parts, last = [], 0
+    for match in QUOTED.finditer(expression):
+        parts += [squeeze(expression[last:match.start()]), match.group()]
+        last = match.end()
+    parts.append(squeeze(expression[last:]))
+    return ''.join(parts).strip()
+
+
+def squeeze(code):
+    return PUNCTUATION.sub(r'\1', re.sub(r'\s+', ' ', code))
+
+
+def cache_key(path, params, bucket):
+    # None for requests that are not cached. Instant queries share the bucket of their evaluation time
+    # (now when unset); range queries are only shared with identical start/end/step.
+    if path not in CACHED_PATHS or not params or 'query' not in params:
+        return None
+    query = normalize_query(str(params['query']))
+    if path == '/api/v1/query':
+        timestamp = float(params.get('time') or time.time())
+        return 'query', query, int(timestamp // bucket)
+    return 'query_range', query, *(str(params.get(name)) for name in ('start', 'end', 'step'))
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class QueryCache:
+    def __init__(self, ttl=1.0, max_entries=1024, bucket=1.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def record(self, result):
+        with self.lock:
+            self.stats[result] += 1
+        telemetry.QUERY_CACHE_REQUESTS.inc(result=result)
+
+    def get(self, key, fetch, cacheable=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                telemetry.QUERY_CACHE_REQUESTS.inc(result='hits')
+                return entry[1]
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = Flight()
+
+        if not leader:
+            # Single flight: wait for the identical request already sent
+            flight.done.wait()
+            self.record('coalesced')
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        self.record('misses')
+        try:
+            flight.value = fetch()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+                if flight.error is None and (cacheable is None or cacheable(flight.value)):
+                    self.store_locked(key, flight.value)
+            flight.done.set()
+        return flight.value
+
+    def store_locked(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+        telemetry.QUERY_CACHE_ENTRIES.set(len(self.entries))
+
+    def hit_ratio(self):
+        served = self.stats['hits'] + self.stats['coalesced']
+        total = served + self.stats['misses']
+        return served / total if total else 0.0
+
+
+def shared_cache(ttl=1.0, max_entries=1024, bucket=1.0):
+    # One cache per process and settings, so several schedulers in the same process share results
+    key = (ttl, max_entries, bucket)
+    with shared_caches_lock:
+        if key not in shared_caches:
+            shared_caches[key] = QueryCache(ttl, max_entries, bucket)
+        return shared_caches[key]
+
+
+class SharedResponse:
+    # A response served to a caller that did not fetch it (cache hit, or another caller's request in
+    # flight): same body, but nothing was transferred for this caller (see prom_client.response_size)
+    cached = True
+
+    def __init__(self, response):
+        self.content = response.content
+        self.headers = response.headers
+        self.status_code = response.status_code
+        self.elapsed = datetime.timedelta(0)
+
+
+class CachingPrometheusClient(PrometheusClient):
+    # Responses are shared between callers: they must only read them
+    def __init__(self, url, cache, **options):
+        super().__init__(url, **options)
+        self.cache = cache
+
+    def cached(self, key, fetch):
+        fetched = []
+        response = self.cache.get(key, lambda: fetched.append(True) or fetch())
+        return response if fetched else SharedResponse(response)
+
+    def get(self, path, params=None):
+        key = cache_key(path, params, self.cache.bucket)
+        if key is None:
+            return PrometheusClient.get(self, path, params)
+        return self.cached(key, lambda: PrometheusClient.get(self, path, params))
+
+    def post(self, path, data=None):
+        key = cache_key(path, data, self.cache.bucket)
+        if key is None:
+            return PrometheusClient.post(self, path, data)
+        return self.cached(key, lambda: PrometheusClient.post(self, path, data))
+
+
+def open_client(url, cache=None, **options):
+    # PrometheusClient, caching when the `cache` config section is enabled
+    if cache and cache.get('enabled'):
+        return CachingPrometheusClient(url, shared_cache(cache.get('ttl', 1.0), cache.get('max_entries', 1024),
+                                                         cache.get('bucket', 1.0)), **options)
+    return PrometheusClient(url, **options)
+
+
+class CachedResponse:
+    def __init__(self, status, content_type, body):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.gzipped = None
+
+    def encoded(self, accept_encoding):
+        # Compressed once per cache entry, not once per consumer
+        if 'gzip' not in accept_encoding or len(self.body) < 1024:
+            return self.body, None
+        if self.gzipped is None:
+            self.gzipped = gzip.compress(self.body, compresslevel=5)
+        return self.gzipped, 'gzip'
+
+
+class QueryCacheProxy:
+    def __init__(self, upstream, cache, port=9092, host='127.0.0.1', timeout=10):
+        import requests
+
+        self.upstream = upstream.rstrip('/')
+        self.cache = cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.request_errors = (requests.RequestException,)
+        self.server = None
+        self.port = port
+        self.host = host
+
+    def forward(self, method, path, body, content_type):
+        response = self.session.request(method, self.upstream + path, data=body or None, timeout=self.timeout,
+                                        headers={'Content-Type': content_type} if content_type else None)
+        return CachedResponse(response.status_code, response.headers.get('Content-Type', 'application/json'),
+                              response.content)
+
+    def handle(self, method, path, body, headers):
+        url = urlsplit(path)
+        content_type = headers.get('Content-Type')
+        if url.path == '/metrics':
+            return CachedResponse(200, 'text/plain; version=0.0.4; charset=utf-8', telemetry.render())
+
+        params = parse_qs(url.query)
+        if body and (content_type or '').startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qs(body.decode()))
+        key = cache_key(url.path, {name: values[0] for name, values in params.items()}, self.cache.bucket)
+        if key is None:
+            return self.forward(method, path, body, content_type)
+        return self.cache.get(key, lambda: self.forward(method, path, body, content_type),
+                              cacheable=lambda response: response.status == 200)
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        proxy = self
+
+        class ProxyHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, method):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    response = proxy.handle(method, self.path, body, self.headers)
+                except proxy.request_errors as e:
+                    self.send_error(502, f'Upstream request failed: {e}')
+                    return
+                payload, encoding = response.encoded(self.headers.get('Accept-Encoding', ''))
+                self.send_response(response.status)
+                self.send_header('Content-Type', response.content_type)
+                if encoding:
+                    self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+        self.server = ThreadingHTTPServer((self.host, self.port), ProxyHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='query-cache', daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.server.server_address[1]}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caching, deduplicating proxy for the Prometheus query API")
+    parser.add_argument('--upstream', default='http://localhost:9090', help='Prometheus server (default: http://localhost:9090)')
+    parser.add_argument('--port', type=int, default=9092, help='Listening port (default: 9092)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ttl', type=float, default=1.0, help='Seconds a result is served from the cache (default: 1)')
+    parser.add_argument('--bucket', type=float, default=1.0, help='Evaluation-time bucket of instant queries in seconds (default: 1)')
+    parser.add_argument('--max-entries', type=int, default=1024, help='LRU size (default: 1024)')
+    args = parser.parse_args(argv)
+
+    proxy = QueryCacheProxy(args.upstream, QueryCache(args.ttl, args.max_entries, args.bucket), args.port, args.host).start()
+    print(f"Caching {args.upstream} on {proxy.url} (hit and miss counters on {proxy.url}/metrics)")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"{proxy.cache.stats}, hit ratio: {proxy.cache.hit_ratio():.1%}")
+    except KeyboardInterrupt:
+        proxy.close()
+
+
+if __name__ == "__main__":
+    main()
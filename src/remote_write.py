@@ -0,0 +1,434 @@
+import collections
+import re
+import struct
+import threading
+import time
+
+import telemetry
+from prom_config import parse_duration
+from tiers import selector_names
+
+try:
+    # Optional: python-snappy's C block codec, much faster than the pure-Python one below
+    import snappy
+except ImportError:
+    snappy = None
+
+# Prometheus remote-write receiver for the 'push' probe mode: Prometheus (or any remote-write sender)
+# POSTs snappy-compressed protobuf WriteRequests to /api/v1/write, and the series matching the vector
+# selectors of a monitored expression are fed to its analyzer as they are ingested, without a single
+# query. Counters read through a range selector (rate(x[1m]), ...) are fed as their per-second rate over
+# that range.
+
+WRITE_PATH = '/api/v1/write'
+# Series without a new sample for this long are dropped, like Prometheus' query lookback
+STALENESS = 300
+
+LABEL_MATCHER = re.compile(r'([A-Za-z_]\w*)\s*(=~|!~|!=|=)\s*(?:"((?:\\.|[^"\\])*)"|\'((?:\\.|[^\'\\])*)\')')
+UNESCAPE = re.compile(r'\\(.)')
+
+
+def read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def write_varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def snappy_decompress(data):
+    # Snappy block format (not the framed stream format), as used by remote write
+    if snappy is not None:
+        return snappy.uncompress(data)
+    length, position = read_varint(data, 0)
+    out = bytearray()
+    while position < len(data):
+        tag = data[position]
+        position += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[position:position + extra], 'little')
+                position += extra
+            size += 1
+            out += data[position:position + size]
+            position += size
+            continue
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = (tag >> 5) << 8 | data[position]
+            position += 1
+        elif kind == 2:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[position:position + 2], 'little')
+            position += 2
+        else:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[position:position + 4], 'little')
+            position += 4
+        if offset == 0 or offset > len(out):
+            raise ValueError('Corrupt snappy block: copy offset out of range')
+        start = len(out) - offset
+        if offset >= size:
+            out += out[start:start + size]
+        else:
+            # Overlapping copy: the last `offset` bytes repeat
+            out += (out[start:] * (size // offset + 1))[:size]
+    if len(out) != length:
+        raise ValueError(f'Corrupt snappy block: expected {length} bytes, got {len(out)}')
+    return bytes(out)
+
+
+def snappy_literal(out, data):
+    size = len(data) - 1
+    if size < 60:
+        out.append(size << 2)
+    else:
+        extra = (size.bit_length() + 7) // 8
+        out.append((59 + extra) << 2)
+        out += size.to_bytes(extra, 'little')
+    out += data
+
+
+def snappy_compress(data):
+    # Greedy matcher on 4-byte prefixes, emitting 2-byte offset copies of up to 64 bytes
+    if snappy is not None:
+        return snappy.compress(data)
+    out = bytearray(write_varint(len(data)))
+    table = {}
+    position = literal_start = 0
+    while position + 4 <= len(data):
+        prefix = data[position:position + 4]
+        candidate = table.get(prefix)
+        table[prefix] = position
+        if candidate is None or position - candidate > 0xffff:
+            position += 1
+            continue
+        if literal_start < position:
+            snappy_literal(out, data[literal_start:position])
+        length = 4
+        while (length < 64 and position + length < len(data)
+               and data[candidate + length] == data[position + length]):
+            length += 1
+        out.append((length - 1) << 2 | 2)
+        out += (position - candidate).to_bytes(2, 'little')
+        position += length
+        literal_start = position
+    if literal_start < len(data):
+        snappy_literal(out, data[literal_start:])
+    return bytes(out)
+
+
+def message_fields(data, start=0, end=None):
+    # (field number, value) of a protobuf message; length-delimited values are (start, end) spans
+    position, end = start, len(data) if end is None else end
+    while position < end:
+        tag, position = read_varint(data, position)
+        number, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            value, position = read_varint(data, position)
+        elif wire_type == 1:
+            value, position = data[position:position + 8], position + 8
+        elif wire_type == 2:
+            length, position = read_varint(data, position)
+            value, position = (position, position + length), position + length
+        elif wire_type == 5:
+            value, position = data[position:position + 4], position + 4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield number, value
+
+
+def decode_write_request(data, names=None):
+    # WriteRequest -> [(sorted label pairs, [(timestamp in seconds, value), ...])]. The samples of series
+    # whose __name__ is not in `names` are skipped without being decoded.
+    series = []
+    for number, (start, end) in ((number, value) for number, value in message_fields(data) if number == 1):
+        labels, sample_spans = [], []
+        for field, value in message_fields(data, start, end):
+            if field == 1:
+                label = dict(message_fields(data, *value))
+                name, label_value = label.get(1, (0, 0)), label.get(2, (0, 0))
+                labels.append((data[name[0]:name[1]].decode(), data[label_value[0]:label_value[1]].decode()))
+            elif field == 2:
+                sample_spans.append(value)
+        labels.sort()
+        if names is not None and dict(labels).get('__name__') not in names:
+            continue
+        samples = []
+        for span in sample_spans:
+            sample = dict(message_fields(data, *span))
+            timestamp = sample.get(2, 0)
+            if timestamp >= 1 << 63:
+                timestamp -= 1 << 64
+            samples.append((timestamp / 1000, struct.unpack('<d', sample[1])[0] if 1 in sample else 0.0))
+        series.append((tuple(labels), samples))
+    return series
+
+
+def length_delimited(number, payload):
+    return write_varint(number << 3 | 2) + write_varint(len(payload)) + payload
+
+
+def encode_write_request(series):
+    # [(labels dict, [(timestamp in seconds, value), ...])] -> WriteRequest, for senders and tests
+    messages = []
+    for labels, samples in series:
+        message = b''.join(length_delimited(1, length_delimited(1, name.encode()) + length_delimited(2, value.encode()))
+                           for name, value in sorted(labels.items()))
+        message += b''.join(length_delimited(2, b'\x09' + struct.pack('<d', value)
+                                             + b'\x10' + write_varint(round(timestamp * 1000) & (1 << 64) - 1))
+                            for timestamp, value in samples)
+        messages.append(length_delimited(1, message))
+    return b''.join(messages)
+
+
+class Selector:
+    # `rate_range`: range in seconds of a counter selector (rate(x[1m]) -> 60), 0 for gauges
+    def __init__(self, name, matchers=(), rate_range=0):
+        self.name = name
+        self.matchers = list(matchers)
+        self.rate_range = rate_range
+
+    def matches(self, labels):
+        if labels.get('__name__') != self.name:
+            return False
+        for label, operator, value in self.matchers:
+            actual = labels.get(label, '')
+            if operator == '=' and actual != value or operator == '!=' and actual == value:
+                return False
+            if operator == '=~' and not value.fullmatch(actual) or operator == '!~' and value.fullmatch(actual):
+                return False
+        return True
+
+
+def parse_selectors(expression):
+    # Vector selectors of a PromQL expression, with their label matchers. Selectors followed by a range
+    # are assumed to be counters under rate()/increase().
+    selectors = []
+    for name in selector_names(expression):
+        pattern = rf'(?<![\w:"\']){re.escape(name)}(?![\w:])\s*(\{{(?:[^}}"\']|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')*\}})?\s*(\[[^\]]*\])?'
+        for match in re.finditer(pattern, expression):
+            matchers = []
+            for label, operator, double_quoted, single_quoted in LABEL_MATCHER.findall(match[1] or ''):
+                value = UNESCAPE.sub(r'\1', double_quoted or single_quoted)
+                matchers.append((label, operator, re.compile(value) if '~' in operator else value))
+            # Subqueries ([5m:1m]) keep their range; a range that is not a duration (a Grafana variable) reads as 1m
+            rate_range = match[2] and (parse_duration(match[2][1:-1].split(':')[0]) or 60)
+            selectors.append(Selector(name, matchers, rate_range=rate_range or 0))
+    return selectors
+
+
+class CounterRange:
+    # Samples of one counter within its selector's range, corrected for counter resets, so that its rate
+    # is that of rate(x[range]) at the latest sample (without Prometheus' extrapolation to the range edges)
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = collections.deque()
+        self.offset = 0.0
+        self.last = None
+
+    def rate(self, timestamp, value):
+        if self.samples and timestamp <= self.samples[-1][0]:
+            return None
+        if self.last is not None and value < self.last:
+            # Counter resets restart from zero
+            self.offset += self.last
+        self.last = value
+        self.samples.append((timestamp, value + self.offset))
+        while self.samples[0][0] <= timestamp - self.seconds:
+            self.samples.popleft()
+        if len(self.samples) < 2:
+            return None
+        (first_time, first), (last_time, last) = self.samples[0], self.samples[-1]
+        return (last - first) / (last_time - first_time)
+
+
+class PushFeed:
+    # Turns the ingested samples of one expression into analyzer probes. Samples are grouped into buckets
+    # of `resolution` seconds (targets are scraped at different offsets), and each bucket becomes one probe
+    # carrying the latest value of every live series, as an instant query at that time would return.
+    def __init__(self, selectors, resolution=0.25):
+        self.selectors = selectors
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        # Per series (sorted label pairs): matching selector (None if it matches none), labels, time of the
+        # last sample, latest probe value and counter samples within the selector's range
+        self.routes = {}
+        self.labels = {}
+        self.seen = {}
+        self.latest = {}
+        self.counters = {}
+        self.current = {}
+        self.bucket = None
+        self.bucket_time = None
+        self.last_prune = 0.0
+
+        self.analyzer = self.alarm = None
+        self.window = 0
+        self.early_decision_changes = 0
+        self.decided = threading.Event()
+        self.on_decide = None
+        self.samples = 0
+        self.analysis_time = 0.0
+
+    def value(self, selector, key, timestamp, value):
+        if not selector.rate_range:
+            return value
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = CounterRange(selector.rate_range)
+        return counter.rate(timestamp, value)
+
+    def add(self, series):
+        ingested = []
+        with self.lock:
+            for key, samples in series:
+                if key not in self.routes:
+                    labels = dict(key)
+                    self.routes[key] = next((selector for selector in self.selectors if selector.matches(labels)), None)
+                    self.labels[key] = labels
+                selector = self.routes[key]
+                self.seen[key] = samples[-1][0] if samples else self.seen.get(key, 0.0)
+                if selector is not None:
+                    ingested += [(timestamp, key, selector, value) for timestamp, value in samples]
+            ingested.sort(key=lambda sample: sample[0])
+
+            for timestamp, key, selector, value in ingested:
+                value = self.value(selector, key, timestamp, value)
+                if value is None:
+                    continue
+                bucket = int(timestamp // self.resolution)
+                if self.bucket is not None and bucket > self.bucket and self.current:
+                    self.emit_locked()
+                if self.bucket is None or bucket > self.bucket:
+                    self.bucket, self.bucket_time = bucket, timestamp
+                self.current[key] = value
+                if self.analyzer is not None:
+                    self.samples += 1
+
+    def emit_locked(self):
+        updated, self.current = self.current, {}
+        self.latest.update(updated)
+        if self.bucket_time - self.last_prune > 60:
+            oldest = self.bucket_time - STALENESS
+            for key in [key for key, timestamp in self.seen.items() if timestamp < oldest]:
+                for table in (self.seen, self.routes, self.labels, self.latest, self.counters):
+                    table.pop(key, None)
+            self.last_prune = self.bucket_time
+        if self.analyzer is None or self.decided.is_set():
+            return
+
+        analysis_start = time.perf_counter()
+        self.analyzer.observe(self.bucket_time, [(self.labels[key], value) for key, value in self.latest.items()])
+        if (self.alarm is not None and self.alarm.observe(list(updated.values()))
+                or self.analyzer.should_decide_early(self.window, self.early_decision_changes)):
+            self.decided.set()
+            if self.on_decide is not None:
+                self.on_decide()
+        self.analysis_time += time.perf_counter() - analysis_start
+
+    def attach(self, analyzer, alarm, window, early_decision_changes, on_decide=None):
+        # The analyzer only receives probes between attach() and detach(), i.e. during its window.
+        # `on_decide` is called (from the receiver thread) when the window should end early.
+        with self.lock:
+            self.analyzer, self.alarm = analyzer, alarm
+            self.window, self.early_decision_changes = window, early_decision_changes
+            self.on_decide = on_decide
+            self.decided.clear()
+            self.samples = 0
+            self.analysis_time = 0.0
+        return self.decided
+
+    def detach(self):
+        with self.lock:
+            if self.current:
+                self.emit_locked()
+            self.analyzer = self.alarm = self.on_decide = None
+            return self.samples, self.analysis_time
+
+
+class RemoteWriteReceiver:
+    def __init__(self, port=9201, host='0.0.0.0', resolution=0.25):
+        self.port = port
+        self.host = host
+        self.resolution = resolution
+        self.feeds = {}
+        self.names = set()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes': 0, 'series': 0, 'samples': 0, 'errors': 0}
+        self.server = None
+
+    def watch(self, expression):
+        selectors = parse_selectors(expression)
+        if not selectors:
+            print(f"No vector selector found in {expression}, it will not receive pushed samples.")
+        feed = self.feeds[expression] = PushFeed(selectors, self.resolution)
+        self.names = self.names | {selector.name for selector in selectors}
+        return feed
+
+    def ingest(self, body):
+        series = decode_write_request(snappy_decompress(body), self.names)
+        samples = sum(len(samples) for _, samples in series)
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += len(body)
+            self.stats['series'] += len(series)
+            self.stats['samples'] += samples
+        telemetry.REMOTE_WRITE_SAMPLES.inc(samples)
+        for feed in tuple(self.feeds.values()):
+            feed.add(series)
+
+    def start(self):
+        # http.server is only imported by schedulers running in push mode
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        receiver = self
+
+        class RemoteWriteHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.split('?')[0] != WRITE_PATH:
+                    self.send_error(404)
+                    return
+                try:
+                    receiver.ingest(body)
+                except (ValueError, IndexError, KeyError, struct.error) as e:
+                    with receiver.lock:
+                        receiver.stats['errors'] += 1
+                    # 4xx: the sender drops the batch instead of retrying it forever
+                    self.send_error(400, f'Malformed remote write request: {e}')
+                    return
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer((self.host, self.port), RemoteWriteHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='remote-write', daemon=True).start()
+        print(f"Receiving remote write on http://{self.host}:{self.server.server_address[1]}{WRITE_PATH}")
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import itertools
+import json
+import time
+from multiprocessing import Pool
+
+from analysis import OnlineAnalyzer, build_window_matrix
+from controllers import CONTROLLERS, make_controller
+
+DEFAULT_POLICY = {
+    'update_threshold': 0.05,
+    'default_scrape_interval': 15,
+    'min_scrape_interval': 10,
+    'max_scrape_interval': 900,
+    'early_decision_changes': 3,
+    'controller': 'halving',
+    # Options of the controllers that accept them (see Controller.options)
+    'samples_per_change': 2.0,
+    'hysteresis': 0.25,
+    'memory': 0.8,
+    'growth': 2.0,
+}
+
+
+def load_csv(path):
+    # Baseline/alarm CSV: one row per series and probe, series identified by their position within a probe
+    updates = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            timestamp = time.mktime(time.strptime(row['Timestamp'], "%Y-%m-%d %H:%M:%S"))
+            probes = updates.setdefault(row['Metric'], [])
+            if not probes or probes[-1][0] != timestamp:
+                probes.append((timestamp, []))
+            samples = probes[-1][1]
+            samples.append(({'series': str(len(samples))}, float(row['Metric Value'])))
+    return updates
+
+
+def load_range_dump(path):
+    # Saved /api/v1/query_range response, or a {metric: response} mapping for several expressions
+    with open(path) as file:
+        dump = json.load(file)
+    if 'data' in dump:
+        dump = {'dump': dump}
+
+    updates = {}
+    for metric_name, response in dump.items():
+        probes = {}
+        for result in response['data']['result']:
+            for timestamp, value in result['values']:
+                probes.setdefault(float(timestamp), []).append((result['metric'], float(value)))
+        updates[metric_name] = sorted(probes.items())
+    return updates
+
+
+def load_series(path):
+    if path.endswith('.json'):
+        return load_range_dump(path)
+    return load_csv(path)
+
+
+def replay(times, matrix, policy, mode='instant', bytes_per_sample=64):
+    # Virtual clock over recorded samples. In instant mode a window of `interval` seconds is followed by a
+    # sleep of the new interval (as in the scheduler's probe windows and due-time heap); in range mode windows
+    # are contiguous and cost one request each. Windows go through the scheduler's OnlineAnalyzer, so an
+    # instant window ends early after `early_decision_changes` significant changes, as it does live.
+    import numpy as np
+
+    interval = policy['default_scrape_interval']
+    controller_options = {key: policy[key] for key in CONTROLLERS[policy['controller']].options}
+    controller = make_controller(policy['controller'], policy['min_scrape_interval'], policy['max_scrape_interval'],
+                                 **controller_options)
+    analyzer = OnlineAnalyzer(policy['update_threshold'])
+    early_decision_changes = policy['early_decision_changes'] if mode == 'instant' else 0
+    clock, end = float(times[0]), float(times[-1])
+    series = matrix.shape[1]
+    columns = [{'series': str(column)} for column in range(series)]
+    present = ~np.isnan(matrix)
+
+    timeline = []
+    samples = 0.0
+    probe_requests = 0
+    while clock < end:
+        low, high = np.searchsorted(times, [clock, clock + interval])
+        window = interval
+        analyzer.start_window()
+        # Interned per window: the analyzer forgets series that were missing from the previous one
+        series_ids = np.fromiter((analyzer.index.intern(labels) for labels in columns), dtype=np.intp, count=series)
+        for row in range(low, high):
+            analyzer.observe_ids(float(times[row]), series_ids[present[row]], matrix[row, present[row]])
+            if analyzer.should_decide_early(interval, early_decision_changes):
+                window = float(times[row]) - clock
+                break
+        stats = analyzer.window_stats()
+        new_interval = controller.next_interval(stats, interval, window)
+        timeline.append({'time': clock - float(times[0]), 'interval': interval, 'window': window,
+                         'new_interval': new_interval, 'significant_changes': stats.significant_changes})
+
+        if mode == 'range':
+            segments = [(clock, interval, interval)]
+            probe_requests += 1
+            next_clock = clock + interval
+        else:
+            segments = [(clock, window, interval), (clock + window, new_interval, new_interval)]
+            probe_requests += max(round(window), 1)
+            next_clock = clock + window + new_interval
+
+        # Scrapes Prometheus performs at the interval in effect during each segment, clipped to the recording
+        for start, length, scrape_interval in segments:
+            samples += max(min(start + length, end) - start, 0) / scrape_interval * series
+        clock = next_clock
+        interval = new_interval
+
+    duration = end - float(times[0])
+    fixed_samples = duration / policy['default_scrape_interval'] * series
+    return {
+        'policy': policy,
+        'mode': mode,
+        'duration': duration,
+        'series': series,
+        'decisions': len(timeline),
+        'samples': round(samples),
+        'fixed_samples': round(fixed_samples),
+        'estimated_bytes': round(samples * bytes_per_sample),
+        'probe_requests': probe_requests,
+        'timeline': timeline,
+    }
+
+
+def run_policy(job):
+    metric_name, times, matrix, policy, mode, bytes_per_sample = job
+    result = replay(times, matrix, policy, mode, bytes_per_sample)
+    result['metric'] = metric_name
+    return result
+
+
+def parse_grid(values):
+    grid = {}
+    for value in values:
+        key, _, options = value.partition('=')
+        if key not in DEFAULT_POLICY:
+            raise SystemExit(f"Unknown policy parameter '{key}', expected one of {', '.join(DEFAULT_POLICY)}")
+        grid[key] = [type(DEFAULT_POLICY[key])(option) for option in options.split(',')]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline replay of recorded series through the scrape interval policy")
+    parser.add_argument('recording', help='Baseline CSV file or saved /api/v1/query_range JSON response')
+    parser.add_argument('--metric', help='Only replay this metric (default: every metric in the recording)')
+    parser.add_argument('--mode', choices=['instant', 'range'], default='instant', help='Probing mode to simulate')
+    parser.add_argument('--grid', action='append', default=[], metavar='PARAM=V1,V2,...',
+                        help='Policy values to grid-search, e.g. update_threshold=0.01,0.05 (repeatable)')
+    parser.add_argument('--bytes-per-sample', type=float, default=64,
+                        help='Estimated exposition bytes per scraped sample (default: 64)')
+    parser.add_argument('--jobs', type=int, default=None, help='Worker processes for the grid search (default: all cores)')
+    parser.add_argument('--output', help='Write every run, including its interval timeline, to this JSON file')
+    for key, value in DEFAULT_POLICY.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    recordings = load_series(args.recording)
+    if args.metric:
+        recordings = {args.metric: recordings[args.metric]}
+
+    grid = parse_grid(args.grid)
+    base_policy = {key: getattr(args, key) for key in DEFAULT_POLICY}
+    policies = [dict(base_policy, **dict(zip(grid, values))) for values in itertools.product(*grid.values())]
+
+    jobs = []
+    for metric_name, updates in recordings.items():
+        times, _, matrix = build_window_matrix(updates)
+        jobs += [(metric_name, times, matrix, policy, args.mode, args.bytes_per_sample) for policy in policies]
+
+    if len(jobs) > 1 and args.jobs != 1:
+        with Pool(args.jobs) as pool:
+            results = pool.map(run_policy, jobs)
+    else:
+        results = [run_policy(job) for job in jobs]
+
+    for result in sorted(results, key=lambda result: (result['metric'], result['samples'])):
+        policy = result['policy']
+        print(f"{result['metric']} | {policy['controller']} threshold={policy['update_threshold']} default={policy['default_scrape_interval']}s "
+              f"min={policy['min_scrape_interval']}s max={policy['max_scrape_interval']}s early={policy['early_decision_changes']} | "
+              f"decisions: {result['decisions']}, samples: {result['samples']} (fixed: {result['fixed_samples']}), "
+              f"~{result['estimated_bytes'] / 1024:.2f} KB, probe requests: {result['probe_requests']}")
+    print(f"\nReplayed {len(results)} runs in {time.time() - start_time:.3f}s")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,159 +1,588 @@
 #!/usr/bin/env python3
 
-import time
-import requests
-import yaml
-import csv
-import os
 import argparse
+import heapq
+import itertools
+import os
+import signal
+import threading
+import time
+
+import telemetry
+from prom_client import response_size
+from prom_config import PrometheusConfig, ConfigWriter
+from sinks import open_sink
+from analysis import OnlineAnalyzer, range_updates
+from controllers import make_controller
+from alarm import AlarmPolicy
+from state import StateStore
+from query_cache import open_client
+from remote_write import RemoteWriteReceiver
+from tiers import TierPlanner, discover_targets
+from sharding import plan_shards, split_metric, worker_csv_file, ForwardingConfigWriter, ChangeReceiver
+
+# Importing this module has no side effects and stays cheap: requests, PyYAML, NumPy, the HTTP server and
+# the thread/process pools are only loaded when a scheduler actually runs (see benchmark/startup_benchmark.py).
+
+RESULT_SCHEMA = [('Timestamp', 'U', None), ('Metric', 'U', None),
+                 ('Bandwidth (Mbps)', 'f8', '.2f'), ('Data Size (KB)', 'f8', '.2f')]
+# With the alarm policy, results keep the columns of the former alarm script (read by benchmark/evaluation.ipynb)
+ALARM_RESULT_SCHEMA = [('Timestamp', 'U', None), ('Metric', 'U', None), ('Metric Value', 'f8', '.6f'),
+                       ('Bandwidth (Mbps)', 'f8', '.2f'), ('Data Size (KB)', 'f8', '.2f'),
+                       ('Cumulative Sum', 'f8', '.6f')]
+ALERT_SCHEMA = [('Timestamp', 'U', None), ('Metric', 'U', None), ('Alert Count', 'i8', None)]
 
-parser = argparse.ArgumentParser(description="Dynamic Prometheus Scrape Interval Scheduler")
-parser.add_argument('--duration', type=int, default=3600,
-                    help='Monitoring duration in seconds (default: 3600). Omit to run indefinitely.')
-args = parser.parse_args()
 
+class ProbeWindow:
+    # A metric's probe window in progress, carried from one probe to the next
+    def __init__(self, metric_name, scrape_interval, analyzer, controller, alarm=None):
+        self.metric_name = metric_name
+        self.scrape_interval = scrape_interval
+        self.analyzer = analyzer
+        self.controller = controller
+        self.alarm = alarm
+        self.start = time.time()
+        self.end = self.start + scrape_interval
+        self.requests_sent = 0
+        self.bytes_fetched = 0
+        self.analysis_time = 0.0
+        self.decided = False
 
-with open('config.yml', 'r') as config_file:
-    config = yaml.safe_load(config_file)
 
-PROMETHEUS_CONFIG_FILE = config['prometheus']['config_file']
-PROMETHEUS_RELOAD_URL = config['prometheus']['reload_url']
-CSV_FILE = config['csv']['file']
-UPDATE_THRESHOLD = config['thresholds']['update_threshold']
-DEFAULT_SCRAPE_INTERVAL = config['thresholds']['default_scrape_interval']
-MAX_SCRAPE_INTERVAL = config['thresholds']['max_scrape_interval']
-METRICS_TO_MONITOR = config['metrics']['to_monitor']
+class Scheduler:
+    def __init__(self, config):
+        self.config = config
+        self.prometheus_url = config['prometheus'].get('url', 'http://localhost:9091')
+        self.prometheus_config_file = config['prometheus']['config_file']
+        self.prometheus_reload_url = config['prometheus']['reload_url']
+        self.reload_debounce = config['prometheus'].get('reload_debounce', 5)
+        self.csv_file = config['csv']['file']
+        self.csv_format = config['csv'].get('format', 'csv')
+        self.sink_options = {key: config['csv'][key] for key in ('flush_rows', 'flush_interval', 'max_rows')
+                             if key in config['csv']}
+        self.update_threshold = config['thresholds']['update_threshold']
+        self.default_scrape_interval = config['thresholds']['default_scrape_interval']
+        self.max_scrape_interval = config['thresholds']['max_scrape_interval']
+        self.min_scrape_interval = config['thresholds'].get('min_scrape_interval', 10)
+        self.early_decision_changes = config['thresholds'].get('early_decision_changes', 3)
+        self.metric_entries = config['metrics']['to_monitor']
+        self.metrics_to_monitor = [split_metric(entry, 'default')[0] for entry in self.metric_entries]
+        self.max_concurrency = config.get('scheduler', {}).get('max_concurrency', 8)
+        self.probe_mode = config.get('scheduler', {}).get('probe_mode', 'instant')
+        self.range_step = config.get('scheduler', {}).get('range_step', 1)
+        self.http_options = config.get('http', {})
+        self.cache_options = config.get('cache') or {}
+        self.telemetry_port = config.get('telemetry', {}).get('port')
+        self.push_options = config.get('push') or {}
+        self.push_port = self.push_options.get('port', 9201)
+        self.sharding = config.get('sharding') or {}
+        tiers = config.get('tiers') or {}
+        self.tier_intervals = tiers.get('intervals', [10, 30, 120, 900]) if tiers.get('enabled') else None
+        self.tier_jobs = tiers.get('jobs') or {}
+        self.tier_refresh = tiers.get('refresh', 300)
+        # Expression -> (discovery time, (job, instance) targets), filled by pool workers
+        self.tier_targets = {}
+        self.controller_options = dict(config.get('controller') or {})
+        self.controller_name = self.controller_options.pop('name', 'halving')
+        self.alarm_options = config.get('alarm') or {}
+        if self.probe_mode == 'push' and self.alarm_options.get('enabled'):
+            # Pushed samples are the raw series behind the expression, not its value: the threshold would be
+            # compared with a different quantity (e.g. an idle seconds rate instead of a CPU percentage)
+            raise ValueError("The alarm policy needs evaluated expression values and cannot run in 'push' probe mode; "
+                             "use the 'instant' or 'range' probe mode, or disable alarm")
+        self.state_options = config.get('state') or {}
+        self.snapshot_interval = self.state_options.get('snapshot_interval', 60)
 
+        # Per-process state, created by setup() in the single-process scheduler or in each sharded worker
+        self.client = self.prometheus_config = self.config_writer = None
+        self.results_sink = self.alert_sink = self.state_store = self.receiver = None
 
-if not os.path.exists(CSV_FILE):
-    with open(CSV_FILE, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Timestamp', 'Metric', 'Bandwidth (Mbps)', 'Data Size (KB)'])
+    def setup(self, prometheus_url=None, config_file=None, reload_url=None,
+              worker_id=None, forward_changes=None, reload_urls=None, push_port=None):
+        prometheus_url = prometheus_url or self.prometheus_url
+        config_file = config_file or self.prometheus_config_file
+        reload_url = reload_url or self.prometheus_reload_url
+        self.client = open_client(prometheus_url, self.cache_options, **{'pool_size': self.max_concurrency, **self.http_options})
+        self.prometheus_config = PrometheusConfig(config_file)
+        if forward_changes is None:
+            self.config_writer = ConfigWriter(self.prometheus_config, reload_urls or reload_url, reload_url,
+                                              session=self.client.session, debounce=self.reload_debounce,
+                                              tiers=TierPlanner(self.tier_intervals) if self.tier_intervals else None)
+        else:
+            self.config_writer = ForwardingConfigWriter(forward_changes)
+        csv_file = self.csv_file if worker_id is None else worker_csv_file(self.csv_file, worker_id)
+        result_schema = ALARM_RESULT_SCHEMA if self.alarm_options.get('enabled') else RESULT_SCHEMA
+        self.results_sink = open_sink(csv_file, result_schema, self.csv_format, **self.sink_options)
+        if self.alarm_options.get('enabled') and self.alarm_options.get('log_file'):
+            alert_file = self.alarm_options['log_file']
+            if worker_id is not None:
+                alert_file = worker_csv_file(alert_file, worker_id)
+            self.alert_sink = open_sink(alert_file, ALERT_SCHEMA, self.csv_format, flush_rows=1)
+        if self.state_options.get('file'):
+            self.state_store = StateStore(self.state_options['file'], self.state_options.get('max_age', 3600))
+        if self.probe_mode == 'push':
+            self.receiver = RemoteWriteReceiver(push_port or self.push_port, self.push_options.get('host', '0.0.0.0'),
+                                                self.push_options.get('resolution', 0.25)).start()
 
-def log_to_csv(timestamp, metric_name, bandwidth_mbps, data_size_kb):
-    with open(CSV_FILE, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([timestamp, metric_name, f"{bandwidth_mbps:.2f}", f"{data_size_kb:.2f}"])
+    def shutdown(self):
+        self.config_writer.close()
+        self.results_sink.close()
+        if self.alert_sink is not None:
+            self.alert_sink.close()
+        if self.state_store is not None:
+            self.state_store.close()
+        if self.receiver is not None:
+            self.receiver.close()
+        self.client.close()
+        print(f"Config writes: {self.config_writer.stats['writes']}, reloads: {self.config_writer.stats['reloads']}, "
+              f"reloads avoided: {self.config_writer.reloads_avoided()}")
 
-def fetch_metric_values(metric_name):
-    start_time = time.time()
-    response = requests.get(f'http://localhost:9091/api/v1/query?query={metric_name}')
-    response_time = time.time() - start_time
+    def log_to_csv(self, timestamp, metric_name, bandwidth_mbps, data_size_kb, metric_value=None, cumulative_sum=None):
+        if self.alarm_options.get('enabled'):
+            # Range probes log one row per window, without a single value
+            nan = float('nan')
+            self.results_sink.write(timestamp, metric_name, nan if metric_value is None else metric_value,
+                                    bandwidth_mbps, data_size_kb, nan if cumulative_sum is None else cumulative_sum)
+        else:
+            self.results_sink.write(timestamp, metric_name, bandwidth_mbps, data_size_kb)
 
-    bandwidth_used = len(response.content)
-    bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time
-    data_size_kb = bandwidth_used / 1024
+    def log_alert(self, metric_name, alert_count):
+        if self.alert_sink is not None:
+            alert_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            self.alert_sink.write(alert_time, metric_name, alert_count)
 
-    current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    results = response.json()['data']['result']
+    def fetch_metric_values(self, metric_name, alarm=None):
+        samples, response = self.client.query_samples(metric_name)
+        # Server response time, without the client-side JSON decoding and connection pool wait
+        response_time = response.elapsed.total_seconds()
 
-    if results:
-        for result in results:
-            metric_value = float(result['value'][1])
+        bandwidth_used = response_size(response)
+        # Responses shared from the query cache were not transferred for this probe: 0 bytes in 0 seconds
+        bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time if response_time else 0.0
+        data_size_kb = bandwidth_used / 1024
+
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+        # Label sets stay raw (interned by the analyzer), each value is parsed once, here
+        values = [float(value) for _, value in samples]
+        # Cumulative sum the alarm policy will have reached at each value
+        cumulative_sum = alarm.cumulative_sum() if alarm is not None else None
+        for metric_value in values:
             print(f"[{current_time}] Metric: '{metric_name}', Metric Value: {metric_value:.6f}, Bandwidth: {bandwidth_mbps:.2f} Mbps, Data Size: {data_size_kb:.2f} KB")
-            log_to_csv(current_time, metric_name, bandwidth_mbps, data_size_kb)
-        return [(result['metric'], float(result['value'][1])) for result in results]
-    return []
-
-def update_prometheus_config(metric_intervals):
-    with open(PROMETHEUS_CONFIG_FILE, 'r') as file:
-        config = yaml.safe_load(file)
-
-    for metric_name, scrape_interval in metric_intervals.items():
-        job_updated = False
-        for job in config['scrape_configs']:
-            if job['job_name'] == metric_name:
-                job['scrape_interval'] = f'{scrape_interval}s'
-                job_updated = True
+            if cumulative_sum is not None:
+                cumulative_sum += metric_value
+            self.log_to_csv(current_time, metric_name, bandwidth_mbps, data_size_kb, metric_value, cumulative_sum)
+        return [raw for raw, _ in samples], values, bandwidth_used
+
+    def fetch_metric_range(self, metric_name, duration):
+        end_time = time.time()
+        results, response = self.client.query_range(metric_name, end_time - duration, end_time, self.range_step)
+        response_time = response.elapsed.total_seconds()
+
+        bandwidth_used = response_size(response)
+        bandwidth_mbps = (bandwidth_used * 8) / (1024 * 1024) / response_time if response_time else 0.0
+        data_size_kb = bandwidth_used / 1024
+
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        print(f"[{current_time}] Metric: '{metric_name}', Range: {duration}s, Series: {len(results)}, Bandwidth: {bandwidth_mbps:.2f} Mbps, Data Size: {data_size_kb:.2f} KB")
+        self.log_to_csv(current_time, metric_name, bandwidth_mbps, data_size_kb)
+        return range_updates(results), bandwidth_used
+
+    def update_prometheus_config(self, metric_intervals, urgent=False):
+        # Changes are queued and written/reloaded once per debounce window by the config writer,
+        # or right away for alarm triggers
+        for metric_name, scrape_interval in metric_intervals.items():
+            if self.tier_intervals:
+                # Retune the exporter targets behind the expression rather than a job named after it
+                if metric_name not in self.tier_targets:
+                    raise RuntimeError(f"Targets of {metric_name} not discovered yet, keeping its interval")
+                _, targets = self.tier_targets[metric_name]
+                self.config_writer.submit(metric_name, scrape_interval, targets, urgent=urgent)
+            else:
+                self.config_writer.submit(metric_name, scrape_interval, urgent=urgent)
+
+    def refresh_targets(self, metric_name):
+        # Run on a pool worker during the window, so that submitting a tier change from the scheduler loop
+        # does not wait for a discovery query. Targets are rediscovered every `tiers.refresh` seconds.
+        discovered = self.tier_targets.get(metric_name)
+        if discovered is not None and time.time() - discovered[0] < self.tier_refresh:
+            return
+        try:
+            targets = discover_targets(self.client, metric_name, self.tier_jobs.get(metric_name))
+        except Exception as e:
+            print(f"Failed to discover the targets of {metric_name}: {e!r}")
+            return
+        self.tier_targets[metric_name] = (time.time(), targets)
+
+    def start_window(self, metric_name, scrape_interval, analyzer, controller, alarm=None, on_decide=None):
+        print(f"Processing metric: {metric_name} with current scrape interval = {scrape_interval}s")
+        window = ProbeWindow(metric_name, scrape_interval, analyzer, controller, alarm)
+        analyzer.start_window()
+        if alarm is not None:
+            alarm.start_window()
+        if self.probe_mode == 'push':
+            # Samples pushed by Prometheus during the window are analysed as they arrive: no query at all
+            decide = (lambda: on_decide(window)) if on_decide is not None else None
+            self.receiver.feeds[metric_name].attach(analyzer, alarm, scrape_interval, self.early_decision_changes, decide)
+        return window
+
+    def probe_metric(self, window):
+        # One probe of a window, run on a pool worker: only the fetch and its analysis hold the worker,
+        # the scheduler loop waits for the next probe time
+        if self.tier_intervals and window.requests_sent == 0:
+            self.refresh_targets(window.metric_name)
+        if self.probe_mode == 'range':
+            self.collect_metric_range(window)
+            return
+        raw_labels, current_metric_values, data_size = self.fetch_metric_values(window.metric_name, window.alarm)
+        window.requests_sent += 1
+        window.bytes_fetched += data_size
+        if current_metric_values:
+            analysis_start = time.perf_counter()
+            window.analyzer.observe_raw(time.time(), raw_labels, current_metric_values)
+            window.analysis_time += time.perf_counter() - analysis_start
+            if window.alarm is not None and window.alarm.observe(current_metric_values):
+                print(f"Alarm threshold crossed for {window.metric_name}, deciding before the window ends.")
+                window.decided = True
+            elif window.analyzer.should_decide_early(window.scrape_interval, self.early_decision_changes):
+                print(f"{window.analyzer.significant_changes} significant changes for {window.metric_name}, deciding before the window ends.")
+                window.decided = True
+
+    def collect_metric_range(self, window):
+        # One query_range call over the window that just ended replaces `duration` instant probes
+        updates, bytes_fetched = self.fetch_metric_range(window.metric_name, window.scrape_interval)
+        window.requests_sent, window.bytes_fetched = 1, bytes_fetched
+        analysis_start = time.perf_counter()
+        for timestamp, current_metric_values in updates:
+            window.analyzer.observe(timestamp, current_metric_values)
+            if window.alarm is not None and window.alarm.observe([value for _, value in current_metric_values]):
                 break
-        if not job_updated:
-            config['scrape_configs'].append({
-                'job_name': metric_name,
-                'scrape_interval': f'{scrape_interval}s',
-                'static_configs': [{'targets': PROMETHEUS_RELOAD_URL}]
+        window.analysis_time += time.perf_counter() - analysis_start
+        window.decided = True
+
+    def detach_push(self, window):
+        samples, window.analysis_time = self.receiver.feeds[window.metric_name].detach()
+        if window.alarm is not None and window.alarm.fired:
+            print(f"Alarm threshold crossed for {window.metric_name}, deciding before the window ends.")
+        elif window.decided:
+            print(f"{window.analyzer.significant_changes} significant changes for {window.metric_name}, deciding before the window ends.")
+        print(f"Ingested {samples} pushed samples for {window.metric_name}")
+
+    def analyze_update_frequency(self, stats, current_scrape_interval, controller, window_duration):
+        return controller.next_interval(stats, current_scrape_interval, window_duration)
+
+    def get_metric_scrape_interval(self, metric_name):
+        return self.prometheus_config.get_scrape_interval(metric_name, self.default_scrape_interval)
+
+    def finish_window(self, window):
+        metric_name, scrape_interval, alarm = window.metric_name, window.scrape_interval, window.alarm
+        if self.probe_mode == 'push':
+            self.detach_push(window)
+        telemetry.ANALYSIS_DURATION.observe(window.analysis_time)
+        stats = window.analyzer.window_stats()
+        window_duration = scrape_interval if self.probe_mode == 'range' else time.time() - window.start
+        print(f"Probe cost for {metric_name} ({self.probe_mode} mode): {window.requests_sent} requests, {window.bytes_fetched / 1024:.2f} KB per decision")
+        # Probe requests per scrape Prometheus performed for this expression during the window
+        telemetry.PROBE_OVERHEAD.set(window.requests_sent * scrape_interval / max(window_duration, 1e-3), metric=metric_name)
+        new_scrape_interval = self.analyze_update_frequency(stats, scrape_interval, window.controller, window_duration)
+        if alarm is not None:
+            if alarm.fired:
+                print(f"Alarm mode triggered for {metric_name}. Scrape interval reset to {self.min_scrape_interval}s")
+                self.log_alert(metric_name, alarm.alert_count)
+            if alarm.fired or alarm.cooling():
+                new_scrape_interval = self.min_scrape_interval
+            alarm.end_window(new_scrape_interval != scrape_interval)
+        return new_scrape_interval
+
+    def snapshot_state(self, metric_names, metric_intervals, due_times, analyzers, controllers, alarms):
+        self.state_store.save({
+            metric_name: (metric_intervals[metric_name], due_times.get(metric_name), {
+                'series': analyzers[metric_name].state(),
+                'controller': controllers[metric_name].state(),
+                'alarm': alarms[metric_name].state() if metric_name in alarms else {},
             })
+            for metric_name in metric_names
+        })
 
-    with open(PROMETHEUS_CONFIG_FILE, 'w') as file:
-        yaml.safe_dump(config, file)
+    def monitor_metrics(self, duration, metrics=None):
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
 
-    response = requests.post(PROMETHEUS_RELOAD_URL)
-    if response.status_code == 200:
-        print("Prometheus reloaded with updated intervals.")
-    else:
-        print("Failed to reload Prometheus")
+        start_time = time.time()
 
-def collect_metric_updates(metric_name, interval, duration):
-    updates = []
-    end_time = time.time() + duration
-    while time.time() < end_time:
-        current_metric_values = fetch_metric_values(metric_name)
-        if current_metric_values:
-            updates.append((time.time(), current_metric_values))
-        time.sleep(interval)
-    return updates
-
-def analyze_update_frequency(updates, current_scrape_interval):
-    total_time = 0
-    significant_changes = 0
-
-    for i in range(1, len(updates)):
-        previous_time, previous_metrics = updates[i - 1]
-        current_time, current_metrics = updates[i]
-        time_difference = current_time - previous_time
-
-        for prev, curr in zip(previous_metrics, current_metrics):
-            prev_value = prev[1]
-            curr_value = curr[1]
-            if prev_value == 0.0:
+        metric_intervals = {
+            metric_name: self.get_metric_scrape_interval(metric_name)
+            for metric_name in (self.metrics_to_monitor if metrics is None else metrics)
+        }
+        analyzers = {metric_name: OnlineAnalyzer(self.update_threshold) for metric_name in metric_intervals}
+        controllers = {metric_name: make_controller(self.controller_name, self.min_scrape_interval, self.max_scrape_interval,
+                                                    **self.controller_options)
+                       for metric_name in metric_intervals}
+        alarms = {}
+        if self.alarm_options.get('enabled'):
+            alarms = {metric_name: AlarmPolicy(self.alarm_options.get('cumulative_threshold', 90), self.alarm_options.get('cooldown', 60))
+                      for metric_name in metric_intervals}
+
+        # Warm restart: resume learned intervals, statistics and due times instead of probing everything at once
+        next_due = {}
+        restored = self.state_store.load(metric_intervals) if self.state_store is not None else {}
+        for metric_name, (scrape_interval, due_time, state) in restored.items():
+            metric_intervals[metric_name] = scrape_interval
+            analyzers[metric_name].restore(state['series'])
+            controllers[metric_name].restore(state['controller'])
+            if metric_name in alarms:
+                alarms[metric_name].restore(state['alarm'])
+            next_due[metric_name] = due_time
+        for metric_name, scrape_interval in metric_intervals.items():
+            telemetry.SCRAPE_INTERVAL.set(scrape_interval, metric=metric_name)
+            if self.receiver is not None:
+                self.receiver.watch(metric_name)
+
+        # Min-heap of (next due time, metric): each metric gets its own probe window as soon as it is due,
+        # instead of waiting for every other metric's window and sleep to finish.
+        # In range mode the due time is the end of the window, which is fetched in one query_range call.
+        due = [(max(next_due.get(metric_name) or start_time, start_time), metric_name) for metric_name in metric_intervals]
+        heapq.heapify(due)
+        # Windows in progress, and a min-heap of their next probe (or, in push mode, their end): a window
+        # waiting for its next probe holds no worker, so max_concurrency caps requests in flight, not windows
+        windows = {}
+        probes = []
+        sequence = itertools.count()
+        running = {}
+        # Finished probes and push windows that decided early, handed back to this loop
+        events = queue.Queue()
+        next_snapshot = start_time + self.snapshot_interval
+
+        def end_window(window, failed=False):
+            # A failed window ends without a decision: the metric keeps its interval
+            metric_name = window.metric_name
+            del windows[metric_name]
+            scrape_interval = metric_intervals[metric_name]
+            try:
+                new_scrape_interval = scrape_interval if failed else self.finish_window(window)
+                if new_scrape_interval != scrape_interval:
+                    alarm = alarms.get(metric_name)
+                    self.update_prometheus_config({metric_name: new_scrape_interval}, urgent=alarm is not None and alarm.fired)
+                    # Only once the change is queued: the next window and the snapshots use the interval in effect
+                    print(f"Adjusting scrape interval for {metric_name}: New Scrape Interval = {new_scrape_interval}s")
+                    metric_intervals[metric_name] = new_scrape_interval
+                    telemetry.SCRAPE_INTERVAL.set(new_scrape_interval, metric=metric_name)
+                elif not failed:
+                    print(f"No significant changes detected for {metric_name}.")
+            except Exception as e:
+                print(f"Failed to process metric {metric_name}: {e!r}")
+            heapq.heappush(due, (time.time() + metric_intervals[metric_name], metric_name))
+
+        def submit_probe(window):
+            future = executor.submit(self.probe_metric, window)
+            running[future] = window
+            future.add_done_callback(events.put)
+
+        def push_decided(window):
+            # Called by the remote-write receiver thread
+            window.decided = True
+            events.put(window)
+
+        # The final snapshot is also taken when interrupted (Ctrl-C, or SIGTERM: see stop_on_sigterm)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                while True:
+                    now = time.time()
+                    stopping = duration and now - start_time > duration
+                    if stopping and not windows:
+                        break
+
+                    if self.state_store is not None and now >= next_snapshot:
+                        # Metrics with a window in flight are saved at the next snapshot
+                        due_times = {metric_name: due_time for due_time, metric_name in due}
+                        self.snapshot_state(due_times, metric_intervals, due_times, analyzers, controllers, alarms)
+                        next_snapshot = now + self.snapshot_interval
+
+                    # Windows in progress first: their next probe, or their end
+                    while probes and probes[0][0] <= now and len(running) < self.max_concurrency:
+                        _, _, window = heapq.heappop(probes)
+                        if windows.get(window.metric_name) is not window:
+                            continue
+                        if self.probe_mode == 'push' or time.time() >= window.end:
+                            end_window(window)
+                        else:
+                            submit_probe(window)
+
+                    while not stopping and due and due[0][0] <= now and len(running) < self.max_concurrency:
+                        _, metric_name = heapq.heappop(due)
+                        try:
+                            window = windows[metric_name] = self.start_window(
+                                metric_name, metric_intervals[metric_name], analyzers[metric_name],
+                                controllers[metric_name], alarms.get(metric_name), push_decided)
+                        except Exception as e:
+                            print(f"Failed to process metric {metric_name}: {e!r}")
+                            heapq.heappush(due, (time.time() + metric_intervals[metric_name], metric_name))
+                            continue
+                        if self.probe_mode == 'push':
+                            heapq.heappush(probes, (window.end, next(sequence), window))
+                            if self.tier_intervals:
+                                # No probe runs on the pool in push mode: discover the targets there anyway
+                                executor.submit(self.refresh_targets, metric_name)
+                        else:
+                            submit_probe(window)
+
+                    wake_times = []
+                    if len(running) < self.max_concurrency:
+                        wake_times += [probes[0][0]] if probes else []
+                        wake_times += [due[0][0]] if due and not stopping else []
+                    if duration and not stopping:
+                        wake_times.append(start_time + duration)
+
+                    try:
+                        event = events.get(timeout=max(min(wake_times) - now, 0) if wake_times else 1)
+                    except queue.Empty:
+                        continue
+
+                    if event in running:
+                        window = running.pop(event)
+                        try:
+                            event.result()
+                        except Exception as e:
+                            print(f"Failed to process metric {window.metric_name}: {e!r}")
+                            end_window(window, failed=True)
+                            continue
+                        if window.decided or self.probe_mode == 'range':
+                            end_window(window)
+                        else:
+                            heapq.heappush(probes, (time.time() + 1, next(sequence), window))
+                    elif windows.get(event.metric_name) is event:
+                        # Push window that decided early
+                        end_window(event)
+        finally:
+            if self.state_store is not None:
+                self.snapshot_state(metric_intervals, metric_intervals, {metric_name: due_time for due_time, metric_name in due},
+                                    analyzers, controllers, alarms)
+
+        if duration:
+            print(f"\n Monitoring finished after {duration} seconds.")
+
+    def run_sharded(self, duration):
+        import multiprocessing
+
+        default_endpoint = {'url': self.prometheus_url, 'config_file': self.prometheus_config_file,
+                            'reload_url': self.prometheus_reload_url}
+        endpoints = {'default': default_endpoint}
+        for name, endpoint in self.sharding.get('endpoints', {}).items():
+            endpoints[name] = dict(default_endpoint, **endpoint)
+        workers = plan_shards(self.metric_entries, endpoints, self.sharding.get('workers') or os.cpu_count())
+
+        # Spawned workers open their own connection pools, writer and sink threads instead of inheriting ours,
+        # and build their scheduler from our config rather than re-reading the file
+        context = multiprocessing.get_context('spawn')
+        changes = {worker['config_key']: context.Queue() for worker in workers}
+        processes = []
+        for index, worker in enumerate(workers):
+            if not worker['metrics'] and not worker['owner']:
                 continue
-            change_percent = abs((curr_value - prev_value) / prev_value)
-            if change_percent > UPDATE_THRESHOLD:
-                total_time += time_difference
-                significant_changes += 1
+            print(f"Worker {worker['id']}: {len(worker['metrics'])} metrics on {worker['url']}"
+                  f"{' (owns ' + worker['config_file'] + ')' if worker['owner'] else ''}")
+            telemetry_port = self.telemetry_port + index if self.telemetry_port else None
+            # In push mode each worker receives on its own port: Prometheus needs one remote_write entry per worker
+            push_port = self.push_port + index if self.probe_mode == 'push' else None
+            process = context.Process(target=run_worker,
+                                      args=(self.config, worker, duration, changes, telemetry_port, push_port),
+                                      name=f"worker-{worker['id']}")
+            process.start()
+            processes.append((worker, process))
 
-    avg_change_time = total_time / significant_changes if significant_changes > 0 else float('inf')
+        try:
+            for worker, process in processes:
+                if not worker['owner']:
+                    process.join()
+        except KeyboardInterrupt:
+            # Workers ignore Ctrl-C: each is stopped with SIGTERM, so it takes its final snapshot and shuts down.
+            # Owners keep applying forwarded changes until the other workers have exited.
+            print("\n Monitoring interrupted, stopping workers.")
+            for worker, process in processes:
+                process.terminate()
+            for worker, process in processes:
+                if not worker['owner']:
+                    process.join()
+        for config_changes in changes.values():
+            config_changes.put(None)
+        for worker, process in processes:
+            if worker['owner']:
+                process.join()
 
-    if avg_change_time < current_scrape_interval:
-        return max(current_scrape_interval // 2, 10)
-    else:
-        return min(current_scrape_interval * 2, MAX_SCRAPE_INTERVAL)
+    def run(self, duration=None):
+        stop_on_sigterm()
+        if self.sharding.get('enabled'):
+            self.run_sharded(duration)
+            return
+        self.setup()
+        try:
+            if self.telemetry_port:
+                telemetry.start_http_server(self.telemetry_port)
+            self.monitor_metrics(duration)
+        except KeyboardInterrupt:
+            print("\n Monitoring interrupted.")
+        finally:
+            self.shutdown()
 
-def get_metric_scrape_interval(metric_name):
-    with open(PROMETHEUS_CONFIG_FILE, 'r') as file:
-        config = yaml.safe_load(file)
 
-    for job in config['scrape_configs']:
-        if job['job_name'] == metric_name:
-            interval = job.get('scrape_interval', f'{DEFAULT_SCRAPE_INTERVAL}s')
-            return int(interval.rstrip('s'))
-    return DEFAULT_SCRAPE_INTERVAL
+def stop_on_sigterm():
+    # SIGTERM (systemd, docker stop, Kubernetes) stops the scheduler like Ctrl-C, so the final state snapshot
+    # and shutdown still run. Handlers can only be installed from the main thread.
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
 
-def monitor_metrics(duration):
-    start_time = time.time()
 
-    metric_intervals = {
-        metric_name: get_metric_scrape_interval(metric_name)
-        for metric_name in METRICS_TO_MONITOR
-    }
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
 
-    while True:
-        if duration and time.time() - start_time > duration:
-            break
 
-        for metric_name, scrape_interval in metric_intervals.items():
-            print(f"Processing metric: {metric_name} with current scrape interval = {scrape_interval}s")
-            updates = collect_metric_updates(metric_name, 1, scrape_interval)
-            new_scrape_interval = analyze_update_frequency(updates, scrape_interval)
+def run_worker(config, worker, duration, changes, telemetry_port, push_port=None):
+    # Ctrl-C reaches every worker of the terminal's process group: workers leave it to the coordinator,
+    # which stops them with SIGTERM once it has stopped waiting for them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop_on_sigterm()
+    scheduler = Scheduler(config)
+    config_changes = changes[worker['config_key']]
+    scheduler.setup(worker['url'], worker['config_file'], worker['reload_url'], worker['id'],
+                    forward_changes=None if worker['owner'] else config_changes, reload_urls=worker['reload_urls'],
+                    push_port=push_port)
+    receiver = ChangeReceiver(config_changes, scheduler.config_writer) if worker['owner'] else None
+    try:
+        if telemetry_port:
+            telemetry.start_http_server(telemetry_port)
+        scheduler.monitor_metrics(duration, worker['metrics'])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if receiver:
+            # Keep applying forwarded changes until the coordinator reports every other worker has finished
+            receiver.join()
+        scheduler.shutdown()
 
-            if new_scrape_interval != scrape_interval:
-                print(f"Adjusting scrape interval for {metric_name}: New Scrape Interval = {new_scrape_interval}s")
-                metric_intervals[metric_name] = new_scrape_interval
-            else:
-                print(f"No significant changes detected for {metric_name}.")
-            time.sleep(new_scrape_interval)
 
-    if args.duration:
-        print(f"\n Monitoring finished after {args.duration} seconds.")
+def load_config(path):
+    import yaml
+
+    with open(path, 'r') as config_file:
+        return yaml.safe_load(config_file)
+
+
+def parse_args(argv=None, description="Dynamic Prometheus Scrape Interval Scheduler"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--duration', type=int, default=3600,
+                        help='Monitoring duration in seconds (default: 3600). Omit to run indefinitely.')
+    parser.add_argument('--config', default=None,
+                        help='Configuration file (default: config.yaml, or config.yml if it does not exist)')
+    args = parser.parse_args(argv)
+    if args.config is None:
+        args.config = 'config.yml' if not os.path.exists('config.yaml') and os.path.exists('config.yml') else 'config.yaml'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    Scheduler(load_config(args.config)).run(args.duration)
+
 
 if __name__ == "__main__":
-    monitor_metrics(args.duration)
+    main()
@@ -0,0 +1,104 @@
+import bisect
+import hashlib
+import os
+import threading
+
+# Sharded execution: a consistent-hash ring spreads the monitored expressions over worker processes,
+# each bound to one Prometheus endpoint. Interval changes for a config file are applied by a single
+# owner worker; the others forward them through a multiprocessing queue.
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=64):
+        # Virtual nodes keep the partition even, and adding a worker only moves ~1/N of the expressions
+        self.ring = sorted((hash_key(f'{node}#{replica}'), node) for node in nodes for replica in range(replicas))
+        self.keys = [key for key, _ in self.ring]
+
+    def node(self, key):
+        index = bisect.bisect(self.keys, hash_key(key)) % len(self.keys)
+        return self.ring[index][1]
+
+
+def split_metric(entry, default_endpoint):
+    # `metrics.to_monitor` entries are expressions, or {query, endpoint} mappings to pin them to an endpoint
+    if isinstance(entry, dict):
+        return entry['query'], entry.get('endpoint', default_endpoint)
+    return entry, default_endpoint
+
+
+def plan_shards(metrics, endpoints, workers_per_endpoint, default_endpoint='default'):
+    # Returns one worker spec per process: its endpoint settings, its expressions and whether it owns
+    # (applies changes to) the endpoint's config file
+    workers = []
+    for endpoint_name, endpoint in endpoints.items():
+        for index in range(max(workers_per_endpoint, 1)):
+            workers.append(dict(endpoint, id=f'{endpoint_name}-{index}', endpoint=endpoint_name, metrics=[]))
+
+    by_endpoint = {}
+    for worker in workers:
+        by_endpoint.setdefault(worker['endpoint'], []).append(worker)
+    rings = {name: HashRing([worker['id'] for worker in group]) for name, group in by_endpoint.items()}
+    by_id = {worker['id']: worker for worker in workers}
+
+    for entry in metrics:
+        query, endpoint_name = split_metric(entry, default_endpoint)
+        if endpoint_name not in rings:
+            raise ValueError(f"Unknown Prometheus endpoint '{endpoint_name}' for metric {query}")
+        by_id[rings[endpoint_name].node(query)]['metrics'].append(query)
+
+    # Endpoints may share a config file: exactly one worker across all of them owns it
+    by_config = {}
+    for worker in workers:
+        by_config.setdefault(os.path.abspath(worker['config_file']), []).append(worker)
+    for config_file, group in by_config.items():
+        owner = HashRing([worker['id'] for worker in group]).node(config_file)
+        reload_urls = list(dict.fromkeys(worker['reload_url'] for worker in group))
+        for worker in group:
+            worker['owner'] = worker['id'] == owner
+            worker['config_key'] = config_file
+            worker['reload_urls'] = reload_urls
+    return workers
+
+
+def worker_csv_file(csv_file, worker_id):
+    # One result file per worker, so processes never interleave appends
+    root, extension = os.path.splitext(csv_file)
+    return f'{root}.{worker_id}{extension}'
+
+
+class ForwardingConfigWriter:
+    # Stands in for ConfigWriter in workers that do not own their config file
+    def __init__(self, changes):
+        self.changes = changes
+        self.stats = {'changes': 0, 'writes': 0, 'reloads': 0, 'failed_reloads': 0,
+                      'coalesced': 0, 'unchanged': 0}
+
+    def submit(self, job_name, scrape_interval, targets=None, urgent=False):
+        self.changes.put((job_name, scrape_interval, targets, urgent))
+        self.stats['changes'] += 1
+
+    def reloads_avoided(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class ChangeReceiver:
+    # Feeds changes forwarded by the other workers into the owner's ConfigWriter until a None sentinel
+    def __init__(self, changes, config_writer):
+        self.changes = changes
+        self.config_writer = config_writer
+        self.thread = threading.Thread(target=self.run, name='change-receiver', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        for change in iter(self.changes.get, None):
+            self.config_writer.submit(*change)
+
+    def join(self):
+        self.thread.join()
@@ -0,0 +1,187 @@
+import atexit
+import csv
+import glob
+import os
+import threading
+
+# Result sinks buffer rows in memory and write them in batches from a background thread,
+# instead of opening the output file once per row.
+# A schema is a list of (column name, numpy dtype, CSV format) tuples.
+
+
+class Sink:
+    def __init__(self, path, schema, flush_rows=1000, flush_interval=5, max_rows=10000):
+        self.path = path
+        self.schema = schema
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max(max_rows, flush_rows)
+
+        self.buffer = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.io_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, name=f'sink-{os.path.basename(path)}', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, *row):
+        with self.condition:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.flush_rows:
+                self.condition.notify()
+            full = len(self.buffer) >= self.max_rows
+        # Bounded memory: when the flusher falls behind, the producer writes the batch itself
+        if full:
+            self.flush()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval)
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        # io_lock is taken first so batches reach the file in the order they were buffered
+        with self.io_lock:
+            with self.condition:
+                rows, self.buffer = self.buffer, []
+            if rows:
+                self.write_rows(rows)
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        # Otherwise atexit keeps every closed sink alive
+        atexit.unregister(self.close)
+        self.thread.join()
+        with self.io_lock:
+            self.close_file()
+
+    def close_file(self):
+        pass
+
+
+class CsvSink(Sink):
+    def __init__(self, path, schema, **options):
+        header = [name for name, _, _ in schema]
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            # Appending rows of another schema (for instance alarm results to a plain results file) would
+            # leave a file that no longer parses
+            with open(path, newline='') as existing:
+                existing_header = next(csv.reader(existing), [])
+            if existing_header != header:
+                raise ValueError(f"'{path}' has columns {existing_header}, expected {header}; "
+                                 f"use another csv.file or move the existing file")
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(header)
+            self.file.flush()
+        super().__init__(path, schema, **options)
+
+    def write_rows(self, rows):
+        formats = [fmt for _, _, fmt in self.schema]
+        self.writer.writerows(
+            [value if fmt is None else format(value, fmt) for value, fmt in zip(row, formats)]
+            for row in rows
+        )
+        self.file.flush()
+
+    def close_file(self):
+        self.file.close()
+
+
+class NpzSink(Sink):
+    # Columnar chunks: <path>/chunk-000000.npz holding one typed array per column
+    def __init__(self, path, schema, **options):
+        os.makedirs(path, exist_ok=True)
+        self.chunk_index = len(glob.glob(os.path.join(path, 'chunk-*.npz')))
+        super().__init__(path, schema, **options)
+
+    def write_rows(self, rows):
+        import numpy as np
+
+        columns = list(zip(*rows))
+        arrays = {name: np.asarray(column, dtype=dtype) for (name, dtype, _), column in zip(self.schema, columns)}
+        np.savez(os.path.join(self.path, f'chunk-{self.chunk_index:06d}.npz'), **arrays)
+        self.chunk_index += 1
+
+
+def parquet_part(path, index):
+    # results.parquet, results.1.parquet, results.2.parquet, ...
+    stem, extension = os.path.splitext(path)
+    return path if index == 0 else f'{stem}.{index}{extension}'
+
+
+def parquet_parts(path):
+    parts = []
+    while os.path.exists(parquet_part(path, len(parts))):
+        parts.append(parquet_part(path, len(parts)))
+    return parts
+
+
+class ParquetSink(Sink):
+    # A Parquet file cannot be appended to: a restarted scheduler writes the next part file instead of
+    # truncating the results of the previous run (CsvSink appends, NpzSink adds chunks)
+    def __init__(self, path, schema, **options):
+        import pyarrow as pa
+
+        types = {'U': pa.string(), 'f8': pa.float64(), 'i8': pa.int64()}
+        self.arrow_schema = pa.schema([(name, types[dtype]) for name, dtype, _ in schema])
+        self.parquet_writer = None
+        self.part_path = parquet_part(path, len(parquet_parts(path)))
+        super().__init__(path, schema, **options)
+
+    def write_rows(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = list(zip(*rows))
+        table = pa.Table.from_arrays([pa.array(column) for column in columns], schema=self.arrow_schema)
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.part_path, self.arrow_schema)
+        self.parquet_writer.write_table(table)
+
+    def close_file(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+SINKS = {'csv': CsvSink, 'npz': NpzSink, 'parquet': ParquetSink}
+
+
+def open_sink(path, schema, format='csv', **options):
+    if format not in SINKS:
+        raise ValueError(f"Unknown sink format '{format}', expected one of {', '.join(SINKS)}")
+    return SINKS[format](path, schema, **options)
+
+
+def load_results(path):
+    import pandas as pd
+
+    if os.path.isdir(path):
+        import numpy as np
+
+        chunks = [np.load(chunk) for chunk in sorted(glob.glob(os.path.join(path, 'chunk-*.npz')))]
+        if not chunks:
+            return pd.DataFrame()
+        return pd.DataFrame({name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0].files})
+    if path.endswith('.parquet'):
+        parts = parquet_parts(path)
+        if len(parts) > 1:
+            return pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
@@ -0,0 +1,52 @@
+import json
+import sqlite3
+import time
+import zlib
+
+# Per-metric scheduler state (interval, next due time, analyzer series statistics, controller and alarm
+# state) snapshotted to SQLite, so a restart resumes where it stopped instead of re-learning every metric.
+# WAL mode lets sharded workers share one file.
+
+
+class StateStore:
+    def __init__(self, path, max_age=3600):
+        self.path = path
+        self.max_age = max_age
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS metric_state ('
+            'metric TEXT PRIMARY KEY, saved_at REAL NOT NULL, scrape_interval INTEGER NOT NULL, '
+            'next_due REAL, state BLOB NOT NULL)'
+        )
+        self.connection.commit()
+
+    def load(self, metrics):
+        # metric -> (scrape interval, next due time, state) for the snapshots younger than max_age
+        rows = self.connection.execute('SELECT metric, saved_at, scrape_interval, next_due, state FROM metric_state')
+        oldest = time.time() - self.max_age
+        loaded, stale = {}, 0
+        wanted = set(metrics)
+        for metric_name, saved_at, scrape_interval, next_due, state in rows:
+            if metric_name not in wanted:
+                continue
+            if saved_at < oldest:
+                stale += 1
+                continue
+            loaded[metric_name] = (scrape_interval, next_due, json.loads(zlib.decompress(state)))
+        print(f"Restored state of {len(loaded)} metrics from {self.path}"
+              f"{f', ignored {stale} stale snapshots' if stale else ''}.")
+        return loaded
+
+    def save(self, snapshot):
+        # snapshot: metric -> (scrape interval, next due time, state), written in one transaction
+        saved_at = time.time()
+        rows = [(metric_name, saved_at, scrape_interval, next_due,
+                 zlib.compress(json.dumps(state, separators=(',', ':')).encode()))
+                for metric_name, (scrape_interval, next_due, state) in snapshot.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO metric_state VALUES (?, ?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,149 @@
+import threading
+
+# Minimal Prometheus exposition of the scheduler's own hot paths, served on /metrics
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{self.format_labels(key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self.values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts followed by the total count and sum
+                counts = self.values[key] = [0] * len(self.buckets) + [0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{self.format_labels(key, [("le", repr(float(bound)))])} {count}')
+                lines.append(f'{self.name}_bucket{self.format_labels(key, [("le", "+Inf")])} {counts[-2]}')
+                lines.append(f'{self.name}_count{self.format_labels(key)} {counts[-2]}')
+                lines.append(f'{self.name}_sum{self.format_labels(key)} {counts[-1]}')
+        return lines
+
+
+REGISTRY = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+QUERY_DURATION = Histogram('pace_query_duration_seconds', 'Prometheus API request latency (time to response headers).',
+                           LATENCY_BUCKETS, ['endpoint'])
+QUERY_RESPONSE_BYTES = Histogram('pace_query_response_bytes', 'Prometheus API response size on the wire.',
+                                 BYTES_BUCKETS, ['endpoint'])
+ANALYSIS_DURATION = Histogram('pace_analysis_duration_seconds', 'CPU time spent analysing one probe window.',
+                              (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+CONFIG_WRITES = Counter('pace_config_writes_total', 'Prometheus configuration files written.')
+RELOADS = Counter('pace_reloads_total', 'Successful Prometheus configuration reloads.')
+RELOAD_FAILURES = Counter('pace_reload_failures_total', 'Failed Prometheus configuration reloads.')
+SCRAPE_INTERVAL = Gauge('pace_scrape_interval_seconds', 'Current scrape interval of each monitored expression.',
+                        ['metric'])
+QUERY_CACHE_REQUESTS = Counter('pace_query_cache_requests_total',
+                               'Cacheable queries by result: hits, misses (sent upstream) and coalesced (awaited in flight).',
+                               ['result'])
+QUERY_CACHE_ENTRIES = Gauge('pace_query_cache_entries', 'Results currently held by the query cache.')
+REMOTE_WRITE_SAMPLES = Counter('pace_remote_write_samples_total',
+                               'Samples of watched series received by the remote-write receiver (push mode).')
+PROBE_OVERHEAD = Gauge('pace_probe_overhead_ratio',
+                       'Probe requests issued per scrape performed by Prometheus during the last window.', ['metric'])
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def start_http_server(port, host='0.0.0.0'):
+    # http.server is only imported by processes that actually serve /metrics
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='telemetry', daemon=True).start()
+    print(f"Serving scheduler metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,53 @@
+import numpy as np
+
+from controllers import NyquistController
+from replay import DEFAULT_POLICY, replay
+
+TIMES = np.arange(0, 7200, 1.0)
+
+
+def intervals(matrix, controller):
+    result = replay(TIMES, matrix, dict(DEFAULT_POLICY, controller=controller))
+    return [window['new_interval'] for window in result['timeline']]
+
+
+def windows_to_max(timeline):
+    return timeline.index(DEFAULT_POLICY['max_scrape_interval']) + 1
+
+
+def test_nyquist_reaches_max_on_quiet_series_faster_than_halving():
+    quiet = np.ones((len(TIMES), 3))
+    nyquist = intervals(quiet, 'nyquist')
+    halving = intervals(quiet, 'halving')
+
+    assert windows_to_max(nyquist) <= 3
+    assert windows_to_max(nyquist) < windows_to_max(halving) == 6
+    # and stays there: no interval held just short of the maximum by hysteresis
+    assert set(nyquist[windows_to_max(nyquist):]) == {DEFAULT_POLICY['max_scrape_interval']}
+
+
+def test_nyquist_tracks_step_series():
+    # Steps every 120s: the interval settles around the change period, it does not run off to the maximum
+    step = np.repeat((np.arange(len(TIMES)) // 120 % 2 * 10.0)[:, None], 3, axis=1)
+    nyquist = intervals(step, 'nyquist')
+
+    assert max(nyquist[len(nyquist) // 2:]) < 600
+    assert min(nyquist[len(nyquist) // 2:]) >= DEFAULT_POLICY['min_scrape_interval']
+
+
+def test_nyquist_skips_hysteresis_at_bounds():
+    class Stats:
+        significant_changes = 0
+
+    controller = NyquistController(10, 900)
+    controller.quiet_windows = 5
+    # 851 * 2 is clamped to 900, within the 25% hysteresis of 851
+    assert controller.next_interval(Stats(), 851, 851) == 900
+
+
+def test_nyquist_state_round_trip():
+    controller = NyquistController(10, 900)
+    controller.changes, controller.duration, controller.quiet_windows = 3.5, 120.0, 2
+    restored = NyquistController(10, 900)
+    restored.restore(controller.state())
+    assert restored.state() == controller.state()
@@ -0,0 +1,84 @@
+import math
+import os
+import random
+
+import pytest
+
+import remote_write
+from remote_write import (PushFeed, decode_write_request, encode_write_request, parse_selectors, snappy_compress,
+                          snappy_decompress)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'write_request.snappy')
+
+
+@pytest.fixture(params=['pure-python', 'python-snappy'])
+def codec(request, monkeypatch):
+    # Both snappy codecs: the pure-Python fallback, and python-snappy when it is installed
+    if request.param == 'pure-python':
+        monkeypatch.setattr(remote_write, 'snappy', None)
+    elif remote_write.snappy is None:
+        pytest.skip('python-snappy is not installed')
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'a',
+    b'abcd' * 100,
+    b'a' * 1000,
+    bytes(random.Random(0).getrandbits(8) for _ in range(5000)),
+    b'node_cpu_seconds_total{cpu="0",mode="idle"} ' * 50 + bytes(range(256)) * 300,
+])
+def test_snappy_round_trip(codec, data):
+    assert snappy_decompress(snappy_compress(data)) == data
+
+
+def test_snappy_rejects_corrupt_block(monkeypatch):
+    monkeypatch.setattr(remote_write, 'snappy', None)
+    with pytest.raises(ValueError):
+        snappy_decompress(b'\x05\x00a\x05\x10\x00')
+
+
+def test_write_request_round_trip():
+    series = [
+        ({'__name__': 'node_load1', 'instance': 'a:9100', 'job': 'node'}, [(1700000000.0, 0.5), (1700000015.25, 1.75)]),
+        ({'__name__': 'up', 'instance': 'b:9100', 'job': 'node', 'zone': 'é'}, [(-1.5, 1.0)]),
+    ]
+    decoded = decode_write_request(snappy_decompress(snappy_compress(encode_write_request(series))))
+    assert decoded == [(tuple(sorted(labels.items())), samples) for labels, samples in series]
+    assert decode_write_request(encode_write_request(series), {'up'}) == decoded[1:]
+
+
+def test_decode_prometheus_payload(codec):
+    # WriteRequest serialized by the reference protobuf runtime from the prompb schema and compressed by
+    # libsnappy, with the exemplars and metadata Prometheus sends alongside the samples
+    with open(FIXTURE, 'rb') as file:
+        series = decode_write_request(snappy_decompress(file.read()))
+
+    assert [dict(labels)['__name__'] for labels, _ in series] == [
+        'node_cpu_seconds_total', 'node_cpu_seconds_total', 'up', 'http_request_duration_seconds_bucket', 'up']
+    labels, samples = series[0]
+    assert labels == (('__name__', 'node_cpu_seconds_total'), ('cpu', '0'), ('instance', 'localhost:9100'),
+                      ('job', 'node_exporter'), ('mode', 'idle'))
+    assert samples == [(1700000000 + i * 15, 1000.25 + i * 14.5) for i in range(4)]
+    assert series[3][1] == [(1700000002.5, 42.0)]
+    # Staleness marker of a target that disappeared
+    (timestamp, value), = series[4][1]
+    assert timestamp == 1700000030 and math.isnan(value)
+
+
+def test_counter_rate_over_selector_range():
+    selector, = parse_selectors('rate(requests_total{job="app"}[1m])')
+    assert selector.rate_range == 60
+    feed = PushFeed([selector])
+    key = (('__name__', 'requests_total'), ('job', 'app'))
+
+    # 1/s for a minute, a counter reset at 75s, then 1/s again
+    rates = [feed.value(selector, key, timestamp, value)
+             for timestamp, value in [(0, 100), (15, 115), (30, 130), (45, 145), (60, 160), (75, 5), (90, 20)]]
+    assert rates[0] is None
+    assert rates[1:5] == [1.0] * 4
+    # Over the samples within the last minute: the reset counts as the 5 requests counted since, not as a drop
+    assert rates[5] == pytest.approx((160 - 130 + 5) / 45)
+    assert rates[6] == pytest.approx((160 - 145 + 20) / 45)
+    # An out-of-order sample is ignored
+    assert feed.value(selector, key, 80, 25) is None
@@ -0,0 +1,64 @@
+import re
+
+# Interval tiers: instead of one scrape job per expression, the targets an expression depends on are
+# grouped into a few fixed scrape intervals, and moved between per-tier copies of their exporter job
+# by relabeling.
+
+PROMQL_KEYWORDS = {'by', 'without', 'on', 'ignoring', 'group_left', 'group_right', 'offset', 'bool',
+                   'and', 'or', 'unless', 'inf', 'nan', 'atan2'}
+
+
+def selector_names(expression):
+    # Metric names of the vector selectors in a PromQL expression
+    expression = re.sub(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', '""', expression)
+    expression = re.sub(r'\{[^}]*\}|\[[^\]]*\]', ' ', expression)
+    expression = re.sub(r'\b(?:by|without|on|ignoring|group_left|group_right)\s*\([^)]*\)', ' ', expression)
+    names = re.findall(r'(?<![\w:.])([A-Za-z_:][\w:]*)(?![\w:]|\s*\()', expression)
+    return sorted({name for name in names if name.lower() not in PROMQL_KEYWORDS})
+
+
+def promql_regex(values):
+    # Alternation matching exactly `values`, escaped for a double-quoted PromQL string
+    return '|'.join(re.escape(value).replace('\\', '\\\\') for value in sorted(values))
+
+
+def discover_targets(client, expression, jobs=None):
+    # (job, instance) pairs feeding an expression: the targets of its explicitly mapped jobs, or of every
+    # series its selectors read
+    if jobs:
+        selector = f'up{{job=~"{promql_regex(jobs)}"}}'
+    else:
+        names = selector_names(expression)
+        if not names:
+            return set()
+        selector = f'{{__name__=~"{promql_regex(names)}"}}'
+    results, _ = client.query(f'group by (job, instance) ({selector})')
+    return {(result['metric']['job'], result['metric']['instance'])
+            for result in results if 'job' in result['metric'] and 'instance' in result['metric']}
+
+
+class TierPlanner:
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals)
+        self.metrics = {}
+
+    def snap(self, interval):
+        # Slowest tier that still scrapes at least as often as requested
+        fitting = [tier for tier in self.intervals if tier <= interval]
+        return fitting[-1] if fitting else self.intervals[0]
+
+    def update(self, metric_name, scrape_interval, targets):
+        # Returns the jobs whose tier assignment may have changed
+        _, previous = self.metrics.get(metric_name, (None, set()))
+        targets = set(targets)
+        self.metrics[metric_name] = (scrape_interval, targets)
+        return {job for job, _ in previous | targets}
+
+    def assignment(self, job_name):
+        # instance -> tier; a target read by several expressions follows the one needing the shortest interval
+        desired = {}
+        for scrape_interval, targets in self.metrics.values():
+            for job, instance in targets:
+                if job == job_name:
+                    desired[instance] = min(scrape_interval, desired.get(instance, scrape_interval))
+        return {instance: self.snap(scrape_interval) for instance, scrape_interval in desired.items()}
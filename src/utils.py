@@ -1,105 +1,56 @@
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import time
+# Evaluation helpers. NumPy is imported on first use so that importing this module stays cheap.
 
-def calculate_precision_np(baseline_metrics, dynamic_metrics, tolerance=0):
-    baseline_metrics = np.array(baseline_metrics)
-    dynamic_metrics = np.array(dynamic_metrics)
-    
-    matching_count = 0
-    
-    
-    for base_value in baseline_metrics:
-        # Compute absolute differences between the baseline value and all dynamic values
-        differences = np.abs(dynamic_metrics - base_value)
-        
-        # Find the minimum difference
-        closest_match_index = np.argmin(differences)
-        closest_match = dynamic_metrics[closest_match_index]
-        
-        # Check if the closest dynamic value is within the tolerance range
-        if np.abs(closest_match - base_value) / base_value <= tolerance:
-            matching_count += 1
-    
-    
-    total_baseline = len(baseline_metrics)
-    precision = (matching_count / total_baseline) * 100
-    
-    return precision
-
-
-
-def log_to_csv(timestamp, metric_name, metric_value, bandwidth_mbps, data_size_kb, cumulative_sum):
-    with open(CSV_FILE, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([timestamp, metric_name, f"{metric_value:.6f}", f"{bandwidth_mbps:.2f}", f"{data_size_kb:.2f}", f"{cumulative_sum:.6f}"])
-
-
-def log_alert(metric_name, alert_count):
-    alert_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    with open(ALERT_LOG_FILE, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow([alert_time, metric_name, alert_count])
-
-
-def collect_metric_updates(metric_name, interval, duration):
-    updates = []
-    end_time = time.time() + duration
-    cumulative_sum = 0
-    while time.time() < end_time:
-        current_metric_values = fetch_metric_values(metric_name)
-        if current_metric_values:
-            updates.append((time.time(), current_metric_values))
-            cumulative_sum += sum(value for metric, value in current_metric_values)
-        time.sleep(interval)
-    return updates, cumulative_sum
 
-def analyze_update_frequency(updates, cumulative_sum, previous_cumulative_sum, current_scrape_interval, alert_counts):
-    total_time = 0
-    significant_changes = 0
-    alarm_mode = False
+def nearest_indices(sorted_values, targets):
+    # Index of the element of sorted_values closest to each target
+    import numpy as np
 
-    for i in range(1, len(updates)):
-        previous_time, previous_metrics = updates[i - 1]
-        current_time, current_metrics = updates[i]
+    right = np.searchsorted(sorted_values, targets)
+    right = np.clip(right, 1, len(sorted_values) - 1) if len(sorted_values) > 1 else np.zeros_like(right)
+    left = right - 1 if len(sorted_values) > 1 else right
+    return np.where(np.abs(sorted_values[left] - targets) <= np.abs(sorted_values[right] - targets), left, right)
 
-        time_difference = current_time - previous_time
 
-        for prev, curr in zip(previous_metrics, current_metrics):
-            prev_value = prev[1]
-            curr_value = curr[1]
+def calculate_precision_np(baseline_metrics, dynamic_metrics, tolerance=0, baseline_times=None, dynamic_times=None,
+                           time_window=None, chunk_size=1_000_000):
+    import numpy as np
 
-            if prev_value == 0.0:
-                continue
+    baseline_metrics = np.asarray(baseline_metrics, dtype=float)
+    dynamic_metrics = np.asarray(dynamic_metrics, dtype=float)
 
-            change_percent = abs((curr_value - prev_value) / prev_value)
-
-            if change_percent > UPDATE_THRESHOLD:
-                total_time += time_difference
-                significant_changes += 1
-
-    if significant_changes > 0:
-        avg_change_time = total_time / significant_changes
+    total_baseline = len(baseline_metrics)
+    if total_baseline == 0 or len(dynamic_metrics) == 0:
+        return 0.0
+
+    time_aware = baseline_times is not None and dynamic_times is not None
+    if time_aware:
+        # Match each baseline sample with the dynamic sample closest in time
+        baseline_times = np.asarray(baseline_times, dtype=float)
+        dynamic_times = np.asarray(dynamic_times, dtype=float)
+        order = np.argsort(dynamic_times, kind='stable')
+        dynamic_times = dynamic_times[order]
+        dynamic_metrics = dynamic_metrics[order]
     else:
-        avg_change_time = float('inf')
+        # Value-only matching: the closest dynamic value, whenever it was scraped
+        dynamic_metrics = np.sort(dynamic_metrics)
 
+    matching_count = 0
+    for start in range(0, total_baseline, chunk_size):
+        base_values = baseline_metrics[start:start + chunk_size]
+        if time_aware:
+            base_times = baseline_times[start:start + chunk_size]
+            closest = nearest_indices(dynamic_times, base_times)
+            matched = np.ones(len(base_values), dtype=bool)
+            if time_window is not None:
+                matched = np.abs(dynamic_times[closest] - base_times) <= time_window
+        else:
+            closest = nearest_indices(dynamic_metrics, base_values)
+            matched = np.ones(len(base_values), dtype=bool)
 
-    cumulative_change = cumulative_sum + previous_cumulative_sum 
-    if cumulative_change > CUMULATIVE_THRESHOLD:
-        print(f"Alert: Significant cumulative change detected! Change = {cumulative_change:.6f}")
-        alarm_mode = True
-        cumulative_sum = 0  # Reset cumulative sum after threshold is achieved
-
+        # Relative tolerance without dividing by the baseline value, so zeros are handled
+        matched &= np.abs(dynamic_metrics[closest] - base_values) <= tolerance * np.abs(base_values)
+        matching_count += int(np.count_nonzero(matched))
 
-    if alarm_mode:
-        alert_counts += 1  # Increment alert count for the metric
-        log_alert(updates[-1][0], alert_counts)  # Log alert time and count
-        return MIN_SCRAPE_INTERVAL, alarm_mode, alert_counts, cumulative_sum
-    else:
-        if avg_change_time < current_scrape_interval:
-            new_scrape_interval = max(current_scrape_interval // 2, MIN_SCRAPE_INTERVAL)
-        else:
-            new_scrape_interval = min(current_scrape_interval * 2, MAX_SCRAPE_INTERVAL)
+    precision = (matching_count / total_baseline) * 100
 
-    return new_scrape_interval, alarm_mode, alert_counts, cumulative_sum
+    return precision